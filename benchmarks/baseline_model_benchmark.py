@@ -0,0 +1,59 @@
+"""Checks the LookupTableBaseline against the station mean map of the geo predictor notebook and measures its throughput.
+
+Run from the repository root:
+
+    python -m benchmarks.baseline_model_benchmark --rows 5000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.baseline import LookupTableBaseline
+from utils.journey_scoring import JourneyScorer
+
+
+def synthetic_stops(n_rows, n_stations=6000, seed=42):
+    rng = np.random.default_rng(seed)
+    station = rng.integers(0, n_stations, n_rows)
+    return pd.DataFrame({
+        "IBNR": 8000000.0 + station,
+        "city": pd.Categorical.from_codes(station // 5, [f"City {index}" for index in range(n_stations // 5)]),
+        "line": pd.Categorical.from_codes(rng.integers(0, 400, n_rows), [f"RE {index}" for index in range(400)]),
+        "arrival_plan": pd.Timestamp("2024-07-01") + pd.to_timedelta(rng.integers(0, 30 * 24 * 60, n_rows), unit="min"),
+    }), pd.Series(rng.exponential(1.0, n_rows).round() * (1 + station % 3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    X, y = synthetic_stops(args.rows)
+    train, test = slice(0, args.rows // 2), slice(args.rows // 2, args.rows)
+    X_train, y_train, X_test = X[train], y[train], X[test].reset_index(drop=True)
+
+    # Only the station level with the global mean as fallback is the model of the notebook
+    stations = LookupTableBaseline(levels=["IBNR"]).fit(X_train, y_train)
+    expected = X_test["IBNR"].map(y_train.groupby(X_train["IBNR"]).mean()).fillna(y_train.mean())
+    np.testing.assert_allclose(stations.predict(X_test), expected.to_numpy(), rtol=1e-12)
+
+    # Updating with the second half of the training data gives the model fit on all of it
+    half = args.rows // 4
+    model = LookupTableBaseline(hour_column="arrival_plan")
+    model.partial_fit(X_train[:half], y_train[:half]).partial_fit(X_train[half:], y_train[half:])
+    full = LookupTableBaseline(hour_column="arrival_plan").fit(X_train, y_train)
+    np.testing.assert_allclose(model.predict(X_test), full.predict(X_test), rtol=1e-12)
+
+    # The model can score journeys although stop_number is not one of its features
+    schedules = X_test[:1000].assign(ID_Base=np.arange(1000) // 10, ID_Timestamp=2407040816, stop_number=np.arange(1000) % 10 + 1)
+    scored = JourneyScorer(stations, schedules).score(3, 2407040816, [0.0, 5.0])
+    assert scored["stop_number"].tolist() == list(range(3, 11))
+    np.testing.assert_allclose(scored["arrival_delay_m"], stations.predict(X_test[32:40]), rtol=1e-12)
+
+    for name, baseline in [("station", stations), ("station/city/line by hour", full)]:
+        start = time.perf_counter()
+        baseline.predict(X_test)
+        seconds = time.perf_counter() - start
+        print(f"{name:<28}{len(X_test) / seconds / 1e6:8.1f} M rows/s")
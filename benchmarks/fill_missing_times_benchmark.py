@@ -0,0 +1,42 @@
+"""Compares the vectorized gap filling of the planned times with the fill_missing_times group loop.
+
+Run from the repository root:
+
+    python -m benchmarks.fill_missing_times_benchmark --journeys 5000
+"""
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.lag_info_extractor_benchmark import synthetic_journeys, timed
+from utils.utils import fill_missing_journey_times, fill_missing_journey_times_groupby
+
+
+def with_gaps(df, share=0.2, seed=42):
+    """Removes the planned times of a share of the stops, including consecutive stops of a journey."""
+    rng = np.random.default_rng(seed)
+    missing = rng.random(len(df)) < share
+    df.loc[missing, "arrival_plan"] = pd.NaT
+    # Some stops keep their departure, those must not be filled
+    df.loc[missing & (rng.random(len(df)) < 0.8), "departure_plan"] = pd.NaT
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journeys", type=int, default=5000)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    df = with_gaps(synthetic_journeys(args.journeys))
+
+    vectorized, vectorized_time = timed(fill_missing_journey_times, df)
+    groupby, groupby_time = timed(fill_missing_journey_times_groupby, df)
+    pd.testing.assert_frame_equal(groupby, vectorized, check_exact=True)
+
+    print(f"{len(df)} rows in {args.journeys} journeys, identical output")
+    print(f"groupby-apply: {groupby_time:8.3f} s")
+    print(f"vectorized:    {vectorized_time:8.3f} s")
+    print(f"speedup:       {groupby_time / vectorized_time:8.1f}x")
@@ -0,0 +1,97 @@
+"""Runs the HereGeocoder against a local stand-in of the HERE API and checks the results and the cache.
+
+The stand-in answers with coordinates, without a result, with a body that
+is not JSON, with an unexpected JSON shape, with a transient error that
+succeeds on the next attempt and with a final error. Run from the
+repository root:
+
+    python -m benchmarks.geocoding_benchmark --names 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.geocoding import GeocodingCache, HereGeocoder
+
+LATENCY = 0.01
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    attempts = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        name = parse_qs(urlparse(self.path).query)["q"][0]
+        with self.lock:
+            attempt = self.attempts[name] = self.attempts.get(name, 0) + 1
+        time.sleep(LATENCY)
+        if name.startswith("bad json"):
+            self.reply(200, b"<html>Service unavailable</html>")
+        elif name.startswith("bad shape"):
+            self.reply(200, json.dumps({"items": [{"title": name}]}).encode())
+        elif name.startswith("flaky") and attempt == 1:
+            self.reply(503, b"")
+        elif name.startswith("forbidden"):
+            self.reply(403, b"")
+        elif name.startswith("unknown"):
+            self.reply(200, json.dumps({"items": []}).encode())
+        else:
+            index = int(name.split()[-1])
+            body = {"items": [{"position": {"lat": 50.0 + index / 1000, "lng": 10.0 + index / 1000}}]}
+            self.reply(200, json.dumps(body).encode())
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/geocode"
+
+    good = [f"station {index}" for index in range(args.names)]
+    names = good + ["unknown 0", "bad json 0", "bad shape 0", "flaky 1", "forbidden 0"]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = GeocodingCache(os.path.join(directory, "cache.sqlite"))
+        geocoder = HereGeocoder(None, cache, url=url, requests_per_second=None, backoff=0.01)
+
+        start = time.perf_counter()
+        results = geocoder.geocode_all(names)
+        seconds = time.perf_counter() - start
+
+        for index, name in enumerate(good):
+            assert results[name] == (50.0 + index / 1000, 10.0 + index / 1000), name
+        assert results["flaky 1"] == (50.001, 10.001)
+        for name in ["unknown 0", "bad json 0", "bad shape 0", "forbidden 0"]:
+            assert results[name] == (None, None), name
+        # Malformed bodies are retried like failed requests, final errors are not
+        assert StandInHandler.attempts["bad json 0"] == geocoder.max_retries + 1
+        assert StandInHandler.attempts["forbidden 0"] == 1
+
+        # Everything with a definitive answer is cached, the failures are requested again in the next run
+        cached = cache.get_many(names)
+        assert set(cached) == set(good) | {"flaky 1", "unknown 0"}, sorted(set(names) - set(cached))
+        assert cached["unknown 0"] == (None, None)
+        StandInHandler.attempts.clear()
+        assert geocoder.geocode_all(names) == results
+        assert set(StandInHandler.attempts) == {"bad json 0", "bad shape 0", "forbidden 0"}
+        cache.close()
+    server.shutdown()
+
+    print(f"Geocoded {len(names)} names in {seconds:.2f}s "
+          f"({len(names) / seconds:.0f} names/s at {LATENCY * 1000:.0f} ms per request)")
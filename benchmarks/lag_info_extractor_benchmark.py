@@ -0,0 +1,76 @@
+"""Compares the segmented kernels of the LagInfoExtractor with the groupby(...).apply implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.lag_info_extractor_benchmark --journeys 20000
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from preprocessors.lag_info_extractor import LagInfoExtractor
+
+
+def synthetic_journeys(n_journeys, max_stops=15, seed=42):
+    """Builds a frame with the columns the per-journey features read, sorted by journey."""
+    rng = np.random.default_rng(seed)
+    n_stops = rng.integers(2, max_stops + 1, n_journeys)
+    n_rows = int(n_stops.sum())
+    journey = np.repeat(np.arange(n_journeys), n_stops)
+    stop_number = np.concatenate([np.arange(1, n + 1) for n in n_stops])
+
+    departure_time = pd.Timestamp("2024-07-01") + pd.to_timedelta(rng.integers(0, 60 * 24 * 30, n_journeys), unit="min")
+    departure_time = departure_time.floor("min").values[journey]
+    travel_minutes = np.cumsum(rng.integers(2, 15, n_rows))
+    travel_minutes -= np.repeat(travel_minutes[np.cumsum(n_stops) - n_stops], n_stops)
+    arrival_plan = departure_time + pd.to_timedelta(travel_minutes, unit="min").values
+    departure_plan = arrival_plan + np.timedelta64(1, "m")
+
+    delays = rng.choice([0.0, 0.0, 1.0, 2.0, 5.0, 10.0, np.nan], n_rows)
+    df = pd.DataFrame(
+        {
+            "ID_Base": pd.array(journey.astype(str), dtype="string"),
+            "ID_Timestamp": pd.array(pd.DatetimeIndex(departure_time).strftime("%y%m%d%H%M"), dtype="string"),
+            "stop_number": stop_number,
+            "lat": rng.uniform(47.5, 54.5, n_rows),
+            "long": rng.uniform(6.0, 14.5, n_rows),
+            "arrival_plan": arrival_plan,
+            "departure_plan": departure_plan,
+            "arrival_delay_m": delays,
+            "departure_delay_m": delays,
+            "departure_time": departure_time,
+        }
+    )
+    df.loc[rng.random(n_rows) < 0.02, ["lat", "long"]] = np.nan
+    return df.sort_values(by=["ID_Base", "ID_Timestamp", "stop_number"]).reset_index(drop=True)
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df.copy())
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journeys", type=int, default=20000)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    extractor = LagInfoExtractor()
+    df = synthetic_journeys(args.journeys)
+
+    # Compile the kernels before measuring
+    extractor.transform_journeys(df.head(100).copy())
+
+    kernels, kernel_time = timed(extractor.transform_journeys, df)
+    groupby, groupby_time = timed(extractor.transform_journeys_groupby, df)
+    pd.testing.assert_frame_equal(groupby, kernels, check_exact=True)
+
+    print(f"{len(df)} rows in {args.journeys} journeys, identical output")
+    print(f"groupby-apply:     {groupby_time:8.3f} s")
+    print(f"segmented kernels: {kernel_time:8.3f} s")
+    print(f"speedup:           {groupby_time / kernel_time:8.1f}x")
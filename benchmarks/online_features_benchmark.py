@@ -0,0 +1,76 @@
+"""Replays journeys event by event through the OnlineFeatureEngine and compares it with the batch LagInfoExtractor.
+
+Run from the repository root:
+
+    python -m benchmarks.online_features_benchmark --journeys 20000
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.lag_info_extractor_benchmark import synthetic_journeys
+from preprocessors.lag_info_extractor import LagInfoExtractor
+from utils.online_features import OnlineFeatureEngine
+
+FEATURES = [
+    "prev_arrival_delay_m",
+    "prev_departure_delay_m",
+    "weighted_avg_prev_delay",
+    "cumulative_delay",
+    "delay_gain",
+    "station_progress",
+    "time_progress",
+    "progress_ratio",
+    "distance_to_prev_stop",
+    "distance_from_origin",
+]
+
+
+def replay(df):
+    """Feeds the stops of all journeys in the order of their planned arrival, so the journeys run concurrently."""
+    engine = OnlineFeatureEngine()
+    journeys = df.groupby(["ID_Base", "departure_time"], sort=False)
+    schedules = journeys.agg(max_stop_number=("stop_number", "max"), last_arrival_plan=("arrival_plan", "last"))
+    for journey, schedule in zip(schedules.index, schedules.itertuples(index=False)):
+        engine.start_journey(journey, journey[1], schedule.max_stop_number, schedule.last_arrival_plan)
+    remaining = journeys.size().to_dict()
+    print(f"{len(engine)} concurrent journeys")
+
+    events = df.sort_values("arrival_plan", kind="stable")
+    rows, latencies = {}, np.empty(len(events), dtype=np.int64)
+    for position, event in enumerate(events.itertuples()):
+        journey = (event.ID_Base, event.departure_time)
+        start = time.perf_counter_ns()
+        rows[event.Index] = engine.update(
+            journey, event.stop_number, event.arrival_plan,
+            event.arrival_delay_m, event.departure_delay_m, event.lat, event.long,
+        )
+        latencies[position] = time.perf_counter_ns() - start
+        remaining[journey] -= 1
+        if remaining[journey] == 0:
+            engine.end_journey(journey)
+    return pd.DataFrame.from_dict(rows, orient="index"), latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journeys", type=int, default=20000)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    df = synthetic_journeys(args.journeys)
+    batch = LagInfoExtractor().transform_journeys(df.copy())
+    online, latencies = replay(df)
+
+    # The batch extractor drops the stops without coordinates. The distances may differ in the last bit,
+    # the vectorized trigonometric functions of numpy do not round exactly like the math module
+    online = online.loc[batch.index, FEATURES]
+    pd.testing.assert_frame_equal(batch[FEATURES], online, check_exact=False, rtol=1e-12, check_dtype=False)
+
+    print(f"{len(df)} stop events, same features as the batch extractor")
+    print(f"p50 latency: {np.percentile(latencies, 50) / 1000:8.2f} us")
+    print(f"p99 latency: {np.percentile(latencies, 99) / 1000:8.2f} us")
+    print(f"throughput:  {len(latencies) / (latencies.sum() / 1e9):8.0f} events/s")
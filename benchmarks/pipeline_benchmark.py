@@ -0,0 +1,104 @@
+"""Times every stage of main.py on synthetic data and fails if a stage exceeds its budget.
+
+Run from the repository root:
+
+    python -m benchmarks.pipeline_benchmark --rows 1M
+    python -m benchmarks.pipeline_benchmark --rows 10M --data-dir /data/synthetic-10M
+
+The budgets in benchmarks/pipeline_budgets.json are given per million input
+rows and scaled to the size of the benchmark.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+import main
+from benchmarks.synthetic_data import generate, parse_rows
+from utils.instrumentation import PeakMemory
+from utils.schema import read_trainrides
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_budgets.json")
+
+
+def run_benchmark(input_path, executor=None):
+    """Returns one measurement per stage, the first one is reading the input."""
+    stages = [("read", lambda _: read_trainrides(input_path))] + [
+        (name, stage) for name, stage, _ in main.build_stages(executor)
+    ]
+    results, df = [], None
+    for name, stage in stages:
+        rows_in = 0 if df is None else len(df)
+        wall, cpu = time.perf_counter(), time.process_time()
+        with PeakMemory() as memory:
+            df = stage(df)
+        results.append({
+            "stage": name,
+            "rows_in": rows_in,
+            "rows_out": len(df),
+            "seconds": time.perf_counter() - wall,
+            "cpu_seconds": time.process_time() - cpu,
+            "peak_rss_mb": memory.peak / 2**20,
+            "peak_increase_mb": memory.increase / 2**20,
+        })
+    return results
+
+
+def check_budgets(results, n_rows, budgets):
+    """Returns a message for every stage that is slower or uses more memory than its scaled budget."""
+    scale = n_rows / 1e6
+    failures = []
+    for result in results:
+        budget = budgets.get(result["stage"])
+        if budget is None:
+            continue
+        if result["seconds"] > budget["seconds"] * scale:
+            failures.append(f"{result['stage']}: {result['seconds']:.1f} s > {budget['seconds'] * scale:.1f} s")
+        if result["peak_increase_mb"] > budget["peak_increase_mb"] * scale:
+            failures.append(
+                f"{result['stage']}: {result['peak_increase_mb']:.0f} MB > {budget['peak_increase_mb'] * scale:.0f} MB"
+            )
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="1M", help="Number of input rows, e.g. 1M, 10M or 100M")
+    parser.add_argument("--data-dir", help="Directory of the synthetic data, generated if it has no DBtrainrides.csv")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", help="Write the measurements as JSON to this file")
+    args = parser.parse_args()
+
+    n_rows = parse_rows(args.rows)
+    data_dir = os.path.abspath(args.data_dir or os.path.join("data", f"synthetic-{args.rows}"))
+    output = os.path.abspath(args.output) if args.output else None
+    if not os.path.exists(os.path.join(data_dir, "DBtrainrides.csv")):
+        print(f"Generating {args.rows} rows in {data_dir}")
+        generate(data_dir, n_rows)
+
+    warnings.simplefilter("ignore")
+    # The stages read their station files from the working directory
+    os.chdir(data_dir)
+    executor = main.JourneyShardExecutor(args.workers) if args.workers > 1 else None
+    results = run_benchmark("DBtrainrides.csv", executor)
+    n_rows = results[0]["rows_out"]
+
+    print(f"{'stage':<22}{'rows in':>12}{'rows out':>12}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'+MB':>10}")
+    for result in results:
+        print(
+            f"{result['stage']:<22}{result['rows_in']:>12}{result['rows_out']:>12}{result['seconds']:>10.2f}"
+            f"{result['cpu_seconds']:>10.2f}{result['peak_rss_mb']:>10.0f}{result['peak_increase_mb']:>10.0f}"
+        )
+    if output:
+        with open(output, "w") as file:
+            json.dump({"rows": n_rows, "workers": args.workers, "stages": results}, file, indent=2)
+
+    with open(args.budgets) as file:
+        failures = check_budgets(results, n_rows, json.load(file))
+    if failures:
+        print("Budget exceeded:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("All stages within budget")
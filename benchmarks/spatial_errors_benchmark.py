@@ -0,0 +1,68 @@
+"""Compares the error grids of utils/spatial_errors.py with the pd.cut/groupby code of the training notebooks.
+
+Run from the repository root:
+
+    python -m benchmarks.spatial_errors_benchmark --rows 2000000 --cell-size 0.1
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.spatial_errors import GERMANY_BOUNDS, create_grid, error_grids
+
+
+def notebook_spatial_mse(X_test, y_test, y_pred, cell_size):
+    """The spatial MSE cell of the training notebooks, on a copy of X_test."""
+    X_test = X_test.copy()
+    lat_edges, lon_edges = create_grid(GERMANY_BOUNDS, cell_size)
+    X_test["lat_bin"] = pd.cut(X_test["lat"], bins=lat_edges)
+    X_test["lon_bin"] = pd.cut(X_test["long"], bins=lon_edges)
+    data = pd.DataFrame({
+        "lat_bin": X_test["lat_bin"],
+        "lon_bin": X_test["lon_bin"],
+        "y_test": y_test,
+        "y_pred": y_pred,
+    })
+    data["squared_error"] = (data["y_test"] - data["y_pred"]) ** 2
+    spatial_mse = data.groupby(["lat_bin", "lon_bin"])["squared_error"].mean().reset_index()
+    spatial_mse.rename(columns={"squared_error": "spatial_mse"}, inplace=True)
+    spatial_mse["spatial_mse"] = np.sqrt(spatial_mse["spatial_mse"])
+    spatial_mse["lat_center"] = spatial_mse["lat_bin"].apply(lambda x: x.mid)
+    spatial_mse["lon_center"] = spatial_mse["lon_bin"].apply(lambda x: x.mid)
+    return spatial_mse.dropna(subset=["spatial_mse"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--cell-size", type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    X_test = pd.DataFrame({
+        "lat": rng.uniform(46.5, 55.5, args.rows),
+        "long": rng.uniform(4.5, 15.5, args.rows),
+    })
+    y_test = pd.Series(rng.exponential(3, args.rows).round())
+    y_pred = y_test + rng.normal(0, 2, args.rows)
+    columns = list(X_test.columns)
+
+    start = time.perf_counter()
+    expected = notebook_spatial_mse(X_test, y_test, y_pred, args.cell_size)
+    notebook_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grids = error_grids(X_test, y_test, y_pred, (args.cell_size, 0.25, 0.5, 1.0))
+    grid_time = time.perf_counter() - start
+    assert list(X_test.columns) == columns
+
+    cells = grids[args.cell_size].to_frame()
+    np.testing.assert_allclose(cells["rmse"], expected["spatial_mse"], rtol=1e-9)
+    np.testing.assert_allclose(cells["lat_center"], expected["lat_center"].astype(float), rtol=1e-12)
+    np.testing.assert_allclose(cells["lon_center"], expected["lon_center"].astype(float), rtol=1e-12)
+
+    print(f"{args.rows} predictions, {len(cells)} cells of {args.cell_size} degrees, same RMSE per cell")
+    print(f"notebook (1 cell size):  {notebook_time:8.3f} s")
+    print(f"error_grids (4 sizes):   {grid_time:8.3f} s")
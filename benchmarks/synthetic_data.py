@@ -0,0 +1,197 @@
+"""Generates a synthetic DBtrainrides.csv with the station files the pipeline reads.
+
+Run from the repository root:
+
+    python -m benchmarks.synthetic_data --rows 1M --output-dir data/synthetic-1M
+"""
+import argparse
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    "ID", "line", "path", "eva_nr", "category", "station", "state", "city", "zip", "long", "lat",
+    "arrival_plan", "departure_plan", "arrival_change", "departure_change",
+    "arrival_delay_m", "departure_delay_m", "info", "arrival_delay_check", "departure_delay_check",
+]
+TOWN_PREFIXES = ["Ber", "Mün", "Ham", "Kö", "Frank", "Stutt", "Düssel", "Dort", "Es", "Leip", "Bre", "Dres",
+                 "Han", "Nürn", "Duis", "Bo", "Wupper", "Biele", "Mann", "Karls", "Augs", "Wies", "Kre", "Aa"]
+TOWN_SUFFIXES = ["lin", "chen", "burg", "ln", "furt", "gart", "dorf", "mund", "sen", "zig", "men", "den",
+                 "nover", "berg", "heim", "stadt", "bach", "hausen", "feld", "chen (Westf)"]
+STATION_TYPES = ["Hbf", "Süd", "Nord", "Ost", "West", "Bf", "Mitte", "Flughafen"]
+STATES = ["Bayern", "Nordrhein-Westfalen", "Baden-Württemberg", "Niedersachsen", "Hessen", "Sachsen", "Berlin", "Hamburg"]
+LINES = ["RE 1", "RE 5", "RB 33", "RB 48", "S 1", "S 5", "S 8", "10", "12", "U4", "STR 3", "IC 2023", ""]
+INFO_MESSAGES = [
+    "Information. (Quelle: zuginfo.nrw)",
+    "Information. (Quelle: DB)",
+    "Bauarbeiten. (Quelle: DB Netz AG)",
+    "Bauarbeiten. (Quelle: zuginfo.nrw)",
+    "Störung. (Quelle: zuginfo.nrw)",
+    "Störung. (Quelle: DB Netz AG)",
+    "Großstörung. (Quelle: DB)",
+    "Verspätung aus vorheriger Fahrt",
+]
+DELAYS = np.array([0, 0, 0, 0, 1, 1, 2, 3, 5, 8, 10, 15, 30], dtype="float64")
+
+
+def parse_rows(value):
+    """Parses row counts like 1M, 10M or 250k."""
+    value = value.strip().upper()
+    factor = {"K": 10**3, "M": 10**6, "G": 10**9}.get(value[-1], 1)
+    return int(float(value[:-1] if factor > 1 else value) * factor)
+
+
+def synthetic_stations(n_stations, rng):
+    names = [f"{prefix}{suffix} {kind}" for prefix, suffix, kind in itertools.product(TOWN_PREFIXES, TOWN_SUFFIXES, STATION_TYPES)]
+    if n_stations > len(names):
+        raise ValueError(f"At most {len(names)} distinct station names are available")
+    names = np.array(names, dtype=object)[rng.choice(len(names), n_stations, replace=False)]
+    cities = np.array([name.rsplit(" ", 1)[0] for name in names], dtype=object)
+    return pd.DataFrame({
+        "name": names,
+        "ibnr": 8000000 + rng.choice(100000, n_stations, replace=False),
+        "lat": rng.uniform(47.3, 55.0, n_stations),
+        "long": rng.uniform(5.9, 15.0, n_stations),
+        "city": cities,
+        "zip": pd.Series(rng.integers(1000, 99999, n_stations)).astype(str).str.zfill(5).to_numpy(),
+        "state": np.array(STATES, dtype=object)[rng.integers(0, len(STATES), n_stations)],
+    })
+
+
+def write_station_files(stations, output_dir, rng):
+    """Writes the stand-ins of ibnr_stations_index.csv, train_stations_europe.csv and the manual coordinates."""
+    n_stations = len(stations)
+    # A few stations are missing from each source, so every fallback of the GeoEncoder is used
+    indexed = rng.random(n_stations) > 0.02
+    pd.DataFrame({
+        "Station Name": stations["name"][indexed].str.upper() + " ",
+        "IBNR": stations["ibnr"][indexed],
+    }).to_csv(os.path.join(output_dir, "ibnr_stations_index.csv"), index=False)
+
+    european = stations[rng.random(n_stations) > 0.05]
+    foreign = pd.DataFrame({
+        "name": [f"Gare {index}" for index in range(n_stations // 10)],
+        "uic": 8700000 + np.arange(n_stations // 10),
+        "latitude": rng.uniform(43.0, 50.0, n_stations // 10),
+        "longitude": rng.uniform(-1.0, 7.0, n_stations // 10),
+        "country": "FR",
+    })
+    pd.concat([
+        pd.DataFrame({
+            "name": european["name"],
+            "uic": european["ibnr"],
+            "latitude": european["lat"],
+            "longitude": european["long"],
+            "country": "DE",
+        }),
+        foreign,
+    ]).reset_index(drop=True).rename_axis("id").to_csv(os.path.join(output_dir, "train_stations_europe.csv"))
+
+    pd.DataFrame({
+        "clear_station_name": stations["name"].str.lower(),
+        "lat": stations["lat"],
+        "long": stations["long"],
+    }).to_csv(os.path.join(output_dir, "station_coordinates_final_manually_updated.csv"), index=False)
+
+
+def synthetic_rides(stations, n_journeys, rng, start="2024-07-01", days=30):
+    """Rows of n_journeys journeys. The path of a stop lists the stations before it, separated by "|"."""
+    n_stops = rng.integers(3, 21, n_journeys)
+    n_rows = int(n_stops.sum())
+    journey = np.repeat(np.arange(n_journeys), n_stops)
+    first_rows = np.cumsum(n_stops) - n_stops
+    stop_number = np.arange(n_rows) - first_rows[journey] + 1
+    last = stop_number == n_stops[journey]
+
+    base = rng.integers(10**12, 10**13, n_journeys).astype(str).astype(object)
+    # Some trains have negative IDs in the original data
+    negative = rng.random(n_journeys) < 0.02
+    base[negative] = "-" + base[negative]
+    departure = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 24 * 60, n_journeys), unit="min")
+    timestamp = departure.strftime("%y%m%d%H%M").to_numpy(dtype=object)
+
+    station = rng.integers(0, len(stations), n_rows)
+    names = stations["name"].to_numpy()[station]
+    paths = np.empty(n_rows, dtype=object)
+    for first, count in zip(first_rows, n_stops):
+        prefixes = list(itertools.accumulate(names[first:first + count - 1], lambda path, name: f"{path}|{name}"))
+        paths[first + 1:first + count] = prefixes
+    paths[first_rows] = np.nan
+    # Canceled stops have no path
+    paths[rng.random(n_rows) < 0.02] = np.nan
+
+    minutes = np.cumsum(rng.integers(2, 15, n_rows))
+    minutes -= minutes[first_rows][journey]
+    arrival_plan = departure.values[journey] + minutes.astype("timedelta64[m]")
+    departure_plan = arrival_plan + np.timedelta64(1, "m")
+    arrival_plan[stop_number == 1] = np.datetime64("NaT")
+    departure_plan[last] = np.datetime64("NaT")
+    no_plan = rng.random(n_rows) < 0.02
+    arrival_plan[no_plan] = np.datetime64("NaT")
+    departure_plan[no_plan] = np.datetime64("NaT")
+
+    arrival_delay = DELAYS[rng.integers(0, len(DELAYS), n_rows)]
+    arrival_delay[stop_number == 1] = np.nan
+    departure_delay = np.where(last, np.nan, np.nan_to_num(arrival_delay) + rng.integers(0, 2, n_rows))
+
+    coordinates = stations[["long", "lat"]].to_numpy()[station]
+    coordinates[rng.random(n_rows) < 0.05] = np.nan
+    info = np.full(n_rows, np.nan, dtype=object)
+    has_info = rng.random(n_rows) < 0.15
+    info[has_info] = np.array(INFO_MESSAGES, dtype=object)[rng.integers(0, len(INFO_MESSAGES), has_info.sum())]
+    line = np.array(LINES, dtype=object)[rng.integers(0, len(LINES), n_journeys)][journey]
+
+    return pd.DataFrame({
+        "ID": base[journey] + "-" + timestamp[journey] + "-" + stop_number.astype(str).astype(object),
+        "line": line,
+        "path": paths,
+        "eva_nr": stations["ibnr"].to_numpy()[station],
+        "category": rng.integers(1, 8, n_rows),
+        "station": names,
+        "state": stations["state"].to_numpy()[station],
+        "city": stations["city"].to_numpy()[station],
+        "zip": stations["zip"].to_numpy()[station],
+        "long": coordinates[:, 0],
+        "lat": coordinates[:, 1],
+        "arrival_plan": arrival_plan,
+        "departure_plan": departure_plan,
+        "arrival_change": arrival_plan + pd.to_timedelta(np.nan_to_num(arrival_delay), unit="min").values,
+        "departure_change": departure_plan + pd.to_timedelta(np.nan_to_num(departure_delay), unit="min").values,
+        "arrival_delay_m": arrival_delay,
+        "departure_delay_m": departure_delay,
+        "info": info,
+        "arrival_delay_check": np.where(np.nan_to_num(arrival_delay) > 5, "delay", "on_time"),
+        "departure_delay_check": np.where(np.nan_to_num(departure_delay) > 5, "delay", "on_time"),
+    })[COLUMNS]
+
+
+def generate(output_dir, n_rows, n_stations=1500, seed=42, chunk_journeys=100_000):
+    """Writes about n_rows rows of complete journeys to output_dir/DBtrainrides.csv, chunk by chunk."""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    stations = synthetic_stations(n_stations, rng)
+    write_station_files(stations, output_dir, rng)
+
+    path = os.path.join(output_dir, "DBtrainrides.csv")
+    written = 0
+    while written < n_rows:
+        # 11.5 stops per journey on average
+        n_journeys = max(1, min(chunk_journeys, round((n_rows - written) / 11.5)))
+        rides = synthetic_rides(stations, n_journeys, rng)
+        rides.to_csv(path, mode="w" if written == 0 else "a", header=written == 0, index=False)
+        written += len(rides)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="1M", help="Number of rows, e.g. 1M, 10M or 100M")
+    parser.add_argument("--output-dir", default="data/synthetic")
+    parser.add_argument("--stations", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    n_rows = generate(args.output_dir, parse_rows(args.rows), args.stations, args.seed)
+    print(f"Wrote {n_rows} rows to {os.path.join(args.output_dir, 'DBtrainrides.csv')}")
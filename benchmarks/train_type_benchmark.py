@@ -0,0 +1,53 @@
+"""Compares the vectorized TrainTypeClassifier with its row by row classification.
+
+Run from the repository root:
+
+    python -m benchmarks.train_type_benchmark --journeys 20000
+"""
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.lag_info_extractor_benchmark import synthetic_journeys, timed
+from preprocessors.train_type import TrainTypeClassifier
+
+LINES = ["RE 1", "RB 33", "S 1", "10", "U4", "STR 3", " ", None]
+
+
+def with_lines(df, seed=42):
+    """Adds a line per journey and moves the stops of a journey closer together, so both train types occur."""
+    rng = np.random.default_rng(seed)
+    journeys, journey = np.unique(df["ID_Base"].to_numpy(dtype=str), return_inverse=True)
+    # Object dtype, on a categorical the row by row apply skips the missing lines instead of categorizing them
+    df["line"] = np.array(LINES, dtype=object)[rng.integers(0, len(LINES), len(journeys))][journey]
+    # Average distances from a few hundred metres to tens of kilometres
+    scale = rng.uniform(0.0005, 0.1, len(journeys))[journey]
+    df["lat"] = 51 + (df["lat"] - 51) * scale
+    df["long"] = 10 + (df["long"] - 10) * scale
+    return df.drop(columns=["departure_time"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journeys", type=int, default=20000)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    df = with_lines(synthetic_journeys(args.journeys))
+    classifier = TrainTypeClassifier()
+
+    vectorized, vectorized_time = timed(classifier.transform_df, df)
+    rowwise, rowwise_time = timed(classifier.transform_df_rowwise, df)
+    columns = ["line_category", "line_prefix", "avg_distance_between_stops", "train_type", "final_train_type"]
+    pd.testing.assert_frame_equal(
+        rowwise[columns], vectorized[columns].astype({"line_category": str, "train_type": str, "final_train_type": str}),
+        check_exact=False, rtol=1e-12,
+    )
+
+    trams = (vectorized["final_train_type"] == "Tram").mean()
+    print(f"{len(df)} rows in {args.journeys} journeys, identical classes ({trams:.0%} trams)")
+    print(f"row by row:  {rowwise_time:8.3f} s")
+    print(f"vectorized:  {vectorized_time:8.3f} s")
+    print(f"speedup:     {rowwise_time / vectorized_time:8.1f}x")
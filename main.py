@@ -1,61 +1,347 @@
+import argparse
+import glob
+import inspect
+import os
+import tempfile
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from preprocessors import info_messages , lag_info_extractor, path_exploder, geo_encoder
-from utils.utils import df_converter, clean_up_df, filter_canceled, ordinal_scaling, normalize_dates
+from preprocessors import info_messages , lag_info_extractor, path_exploder, geo_encoder, train_type
+from utils.instrumentation import configure, measure
+from utils.pipeline import StageGraph
+from utils.sharding import JourneyShardExecutor
+from utils.schema import DATE_COLUMNS, RAW_DTYPES, read_trainrides
+from utils.stage_cache import StageCache, source_files
+from utils.streaming import GlobalStats, iter_journey_chunks, load_state, save_state
+from utils.utils import clean_up_df, filter_canceled, ordinal_scaling, normalize_dates, fill_missing_dates, apply_date_normalization
 
-if __name__ == "__main__":
-    # Preprocessing steps
-    train_df = pd.read_csv("DBtrainrides.csv")
+COLUMNS_TO_DROP = [
+    "info",
+    "last_station",
+    "city",
+    "line",
+    "starting_station_IBNR",
+    "zip",
+    "arrival_change",
+    "departure_change",
+    "info_present",
+    "clear_station_name",
+    "departure_time",
+    "origin_departure_plan",
+    "planned_elapsed_time",
+    "total_planned_time",
+    "next_arrival_plan",
+    "planned_travel_time_to_next_stop",
+    "progress_ratio",
+    "distance_to_prev_stop",
+    "distance_to_next_stop",
+    "distance_from_origin",
+    "distance_progress",
+    "total_distance",
+    "avg_city_delay",
+    "departure_delay_m",
+    "cumulative_delay",
+    "delay_gain",
+    "time_progress",
+]
+OUTPUT_COLUMNS = [
+    "ID_Base",
+    "ID_Timestamp",
+    "stop_number",
+    "IBNR",
+    "long",
+    "lat",
+    "arrival_plan",
+    "departure_plan",
+    "arrival_delay_m",
+    "transformed_info_message",
+    "prev_arrival_delay_m",
+    "prev_departure_delay_m",
+    "weighted_avg_prev_delay",
+    "max_station_number",
+    "station_progress",
+    "info_label_encoded",
+    "arrival_normalized",
+    "departure_normalized",
+]
+MESSAGE_ORDER = ["No message", "Information", "Bauarbeiten", "Störung", "Großstörung"]
+# Raw columns every run reads: the journey IDs and paths, the starting station, the coordinates, the planned times and the target
+REQUIRED_RAW_COLUMNS = ["ID", "path", "eva_nr", "long", "lat", "arrival_plan", "departure_plan", "arrival_delay_m"]
+INFO_COLUMNS = ["info", "info_present", "transformed_info_message", "info_label_encoded"]
+
+
+def raw_columns(columns=None):
+    """Returns the columns of DBtrainrides.csv the output columns depend on, None for all of them."""
+    if columns is None:
+        return None
+    unknown = set(columns) - set(OUTPUT_COLUMNS) - set(COLUMNS_TO_DROP) - set(train_type.TrainTypeClassifier.writes)
+    if unknown:
+        raise ValueError(f"Unknown output columns: {', '.join(sorted(unknown))}")
+    needed = set(REQUIRED_RAW_COLUMNS) | set(columns)
+    if not needed.isdisjoint(INFO_COLUMNS):
+        needed.add("info")
+    if not needed.isdisjoint(lag_info_extractor.LagInfoExtractor.DELAY_FEATURES):
+        needed.add("departure_delay_m")
+    if not needed.isdisjoint(lag_info_extractor.LagInfoExtractor.CITY_FEATURES):
+        needed.add("city")
+    if not needed.isdisjoint(train_type.TrainTypeClassifier.writes):
+        needed.add("line")
+    return [column for column in list(RAW_DTYPES) + DATE_COLUMNS if column in needed]
 
-    path_exploder = path_exploder.PathExploder()
-    train_df = path_exploder.transform(train_df)
-    
-    train_df = df_converter(train_df)
 
+def finalize(train_df, executor=None, columns=None):
+    with measure("Finalize", "finalize", train_df) as record:
+        # With the output columns given, the dropped columns that were not computed are skipped and requested ones kept
+        if columns is None:
+            train_df = clean_up_df(train_df, COLUMNS_TO_DROP)
+        else:
+            train_df = clean_up_df(train_df, [column for column in COLUMNS_TO_DROP if column in train_df and column not in columns])
+        train_df = filter_canceled(train_df)
+        if "transformed_info_message" in train_df:
+            train_df = ordinal_scaling(train_df, "transformed_info_message", "info_label_encoded", MESSAGE_ORDER)
+        train_df = normalize_dates(train_df, executor)
+        if columns is not None:
+            train_df = train_df[columns]
+        record["rows_out"] = len(train_df)
+    return train_df
+
+
+def build_stages(executor=None, columns=None, train_types=False):
+    """Returns the pipeline as a list of (name, function, files the stage depends on).
+
+    With the output columns given (lazy mode), the stages only compute what these columns depend on.
+    With train_types, the TrainTypeClassifier adds the final_train_type of every stop.
+    """
+    needed = None if columns is None else set(raw_columns(columns)) | set(columns)
+    exploder = path_exploder.PathExploder()
     cleaner = info_messages.InfoMessageCleaner()
-    train_df = cleaner.transform_df(train_df)
-
-    geo_encoder = geo_encoder.GeoEncoder()
-    train_df = geo_encoder.transform(train_df)
-
-    train_df = df_converter(train_df)
-
-    lag_info_extractor = lag_info_extractor.LagInfoExtractor()
-    train_df = lag_info_extractor.transform(train_df)
-    
-    columns = [
-        "info", 
-        "last_station", 
-        "city",
-        "line",
-        "starting_station_IBNR",
-        "zip",
-        "arrival_change",
-        "departure_change",
-        "info_present",
-        "clear_station_name",
-        "departure_time",
-        "origin_departure_plan",
-        "planned_elapsed_time",
-        "total_planned_time",
-        "next_arrival_plan",
-        "planned_travel_time_to_next_stop",
-        "progress_ratio",
-        "distance_to_prev_stop",
-        "distance_to_next_stop",
-        "distance_from_origin",
-        "distance_progress",
-        "total_distance",
-        "avg_city_delay",
-        "departure_delay_m",
-        "cumulative_delay",
-        "delay_gain",
-        "time_progress",
+    encoder = geo_encoder.GeoEncoder()
+    classifier = train_type.TrainTypeClassifier()
+    extractor = lag_info_extractor.LagInfoExtractor(executor=executor, features=needed)
+
+    def depends_on(stage):
+        # The source of the stage and of the project modules it imports is part of the key so code changes invalidate the cache
+        return stage.input_files + source_files(inspect.getsourcefile(type(stage))) + source_files(inspect.getsourcefile(read_trainrides))
+
+    stages = [
+        (exploder.name, exploder.transform, depends_on(exploder)),
+        (cleaner.name, cleaner.transform_df, depends_on(cleaner)),
+        (encoder.name, encoder.transform, depends_on(encoder)),
+        (classifier.name, classifier.transform, depends_on(classifier)),
+        (extractor.name, extractor.transform, depends_on(extractor)),
+        ("Finalize", lambda df: finalize(df, executor, columns), [inspect.getsourcefile(finalize)] + source_files(inspect.getsourcefile(clean_up_df))),
     ]
+    if needed is not None and needed.isdisjoint(INFO_COLUMNS):
+        stages = [stage for stage in stages if stage[0] != cleaner.name]
+    if not train_types and (needed is None or needed.isdisjoint(classifier.writes)):
+        stages = [stage for stage in stages if stage[0] != classifier.name]
+    return stages
+
+
+def run_stages(input_path, stages, cache=None, stage_threads=4, columns=None):
+    """Runs the stages on the input file, skipping every stage whose cached output is current.
+
+    Stages that touch disjoint columns run at the same time, see StageGraph. In
+    lazy mode only the raw columns the output columns depend on are read.
+    """
+    if cache is None:
+        graph = StageGraph(stages, stage_threads)
+        train_df = graph.run(read_trainrides(input_path, raw_columns(columns)))
+        print(graph.report())
+        return train_df
+
+    keys = []
+    key = cache.fingerprint_file(input_path)
+    if columns is not None:
+        # The stages of a lazy run have fewer columns than the same stages of a full run
+        key = cache.stage_key("read", key, config={"columns": columns})
+    for name, _, files in stages:
+        key = cache.stage_key(name, key, files)
+        keys.append(key)
+
+    # Resume from the last stage with a current output
+    start, train_df = 0, None
+    for index in reversed(range(len(stages))):
+        name = stages[index][0]
+        if cache.has(name, keys[index]):
+            print(f"Resuming after cached stage {name}")
+            train_df = cache.load(name, keys[index])
+            start = index + 1
+            break
+    if train_df is None:
+        train_df = read_trainrides(input_path, raw_columns(columns))
+
+    # Only the outputs of the stages that may change the rows are complete frames, the others are merged later
+    graph = StageGraph(stages[start:], stage_threads)
+    train_df = graph.run(
+        train_df, lambda index, df: cache.store(stages[start + index][0], keys[start + index], df)
+    )
+    if start < len(stages):
+        print(graph.report())
+    return train_df
+
+
+def write_output(train_df, output_path):
+    if output_path.endswith(".parquet"):
+        train_df.to_parquet(output_path, index=False)
+    else:
+        train_df.to_csv(output_path, index=False)
+
+
+def run_streaming(input_path, output_path, partition_bytes, executor=None):
+    """Runs the pipeline on journey-complete chunks so the peak memory only depends on the chunk size.
 
-    train_df = clean_up_df(train_df, columns)
+    The first pass runs every journey based step per chunk and reduces the
+    partial aggregates of the global statistics, the second pass applies
+    them and appends the chunk to the output.
+    """
+    stages = build_stages(executor)[:-1]
+    stats = GlobalStats()
+
+    with tempfile.TemporaryDirectory(prefix="spill-", dir=os.path.dirname(os.path.abspath(output_path))) as spill_dir:
+        spilled = []
+        for index, chunk in enumerate(iter_journey_chunks(input_path, spill_dir, partition_bytes)):
+            print(f"Processing chunk {index + 1}...")
+            for _, stage, _ in stages:
+                chunk = stage(chunk)
+            stats.update_city_delays(chunk)
+            chunk = filter_canceled(chunk)
+            chunk = ordinal_scaling(chunk, "transformed_info_message", "info_label_encoded", MESSAGE_ORDER)
+            chunk = fill_missing_dates(chunk, executor)
+            stats.update_date_bounds(chunk)
+
+            path = os.path.join(spill_dir, f"stage-{index}.parquet")
+            chunk.to_parquet(path)
+            spilled.append(path)
+            del chunk
+
+        city_avg_delay = stats.city_avg_delay
+        writer = None
+        for index, path in enumerate(spilled):
+            chunk = pd.read_parquet(path)
+            os.remove(path)
+            chunk["avg_city_delay"] = chunk["city"].map(city_avg_delay)
+            chunk = clean_up_df(chunk, COLUMNS_TO_DROP)
+            chunk = apply_date_normalization(chunk, stats.arrival_min, stats.arrival_max)
+
+            if output_path.endswith(".parquet"):
+                table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(output_path, mode="w" if index == 0 else "a", header=index == 0, index=False)
+        if writer is not None:
+            writer.close()
+
+
+def run_incremental(input_path, output_dir, executor=None):
+    """Appends the journeys of a new input file to a dataset of Parquet parts in output_dir.
+
+    The global statistics are persisted in output_dir/state.json as running
+    sums, counts and bounds. Only the new journeys go through the stages,
+    the existing parts are only rewritten if the date bounds change.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, "state.json")
+    stats, batches = load_state(state_path)
+    # Files of a batch whose statistics were not saved are removed, the batch is processed again
+    for path in glob.glob(os.path.join(output_dir, "*.parquet*")):
+        if os.path.basename(path).split("-")[-1].split(".")[0] not in batches:
+            os.remove(path)
+
+    # The journeys of the raw input are recorded per batch, including those that are filtered out later
+    train_df = read_trainrides(input_path)
+    ids = train_df["ID"].astype(str).str.rsplit("-", n=2)
+    row_journeys = pd.MultiIndex.from_arrays([ids.str[0], ids.str[1]], names=["ID_Base", "ID_Timestamp"])
+    if batches:
+        known = pd.concat(pd.read_parquet(os.path.join(output_dir, f"journeys-{batch}.parquet")) for batch in batches)
+        new = ~row_journeys.isin(pd.MultiIndex.from_frame(known))
+        train_df, row_journeys = train_df[new], row_journeys[new]
+    journeys = row_journeys.unique().to_frame(index=False)
+    if train_df.empty:
+        print("No new journeys")
+        return
+
+    for _, stage, _ in build_stages(executor)[:-1]:
+        train_df = stage(train_df)
+    stats.update_city_delays(train_df)
     train_df = filter_canceled(train_df)
-    message_order = ["No message", "Information", "Bauarbeiten", "Störung", "Großstörung"]
-    train_df = ordinal_scaling(train_df, "transformed_info_message", "info_label_encoded", message_order)
-    train_df = normalize_dates(train_df)
-    train_df.to_csv("DBtrainrides_complete_preprocessed_2.csv", index=False)
+    train_df = ordinal_scaling(train_df, "transformed_info_message", "info_label_encoded", MESSAGE_ORDER)
+    train_df = fill_missing_dates(train_df, executor)
+    previous_bounds = stats.date_bounds
+    stats.update_date_bounds(train_df)
+
+    train_df["avg_city_delay"] = train_df["city"].map(stats.city_avg_delay)
+    train_df = clean_up_df(train_df, COLUMNS_TO_DROP)
+    train_df = apply_date_normalization(train_df, stats.arrival_min, stats.arrival_max)
+
+    if batches and stats.date_bounds != previous_bounds:
+        # Only the normalized dates depend on the bounds, all other columns of the parts stay as they are
+        print(f"Date bounds changed, renormalizing {len(batches)} parts")
+        span = stats.arrival_max - stats.arrival_min
+        for batch in batches:
+            path = os.path.join(output_dir, f"part-{batch}.parquet")
+            part_df = pd.read_parquet(path)
+            part_df["arrival_normalized"] = (part_df["arrival_plan"] - stats.arrival_min) / span
+            part_df["departure_normalized"] = (part_df["departure_plan"] - stats.arrival_min) / span
+            part_df.to_parquet(f"{path}.tmp", index=False)
+            os.replace(f"{path}.tmp", path)
+
+    # The batch only counts as written once it is listed in the state
+    batch = f"{len(batches):05d}"
+    path = os.path.join(output_dir, f"part-{batch}.parquet")
+    train_df.to_parquet(path, index=False)
+    journeys.to_parquet(os.path.join(output_dir, f"journeys-{batch}.parquet"), index=False)
+    save_state(state_path, stats, batches + [batch])
+    print(f"Appended {len(train_df)} rows to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocessing pipeline for the DB train rides dataset")
+    parser.add_argument("--input", default="DBtrainrides.csv")
+    parser.add_argument("--output", default="DBtrainrides_complete_preprocessed_2.csv",
+                        help="Output file, written as Parquet if it ends with .parquet and as CSV otherwise")
+    parser.add_argument("--cache-dir", default=".stage_cache")
+    parser.add_argument("--no-cache", action="store_true", help="Run every stage without the stage cache")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Process the input in journey-complete chunks with bounded memory (bypasses the stage cache)")
+    parser.add_argument("--append", action="store_true",
+                        help="Append the journeys of the input that are not yet in the output, which is a directory of Parquet parts")
+    parser.add_argument("--chunk-mb", type=float, default=256, help="Approximate size of the input chunks in streaming mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes for the per-journey features and the date filling")
+    parser.add_argument("--stage-threads", type=int, default=4,
+                        help="Number of stages that touch disjoint columns to run at the same time")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Only read and compute what the output columns depend on, instead of dropping the rest at the end")
+    parser.add_argument("--columns", help="Comma separated output columns, implies --lazy (default: the usual output columns)")
+    parser.add_argument("--train-types", action="store_true",
+                        help="Add the final_train_type (Regional Train or Tram) of every stop to the output")
+    parser.add_argument("--metrics", help="Append the metrics of every stage to this file, "
+                        "in the Prometheus text format if it ends with .prom and as JSON lines otherwise")
+    parser.add_argument("--profile-dir", help="Write a cProfile dump of every stage to this directory")
+    args = parser.parse_args()
+
+    if args.metrics or args.profile_dir:
+        configure(args.metrics, args.profile_dir)
+
+    executor = JourneyShardExecutor(args.workers) if args.workers > 1 else None
+
+    # Preprocessing steps
+    if args.append:
+        run_incremental(args.input, args.output, executor)
+    elif args.streaming:
+        run_streaming(args.input, args.output, int(args.chunk_mb * 2**20), executor)
+    else:
+        columns = args.columns.split(",") if args.columns else OUTPUT_COLUMNS if args.lazy else None
+        if args.train_types and columns is not None and "final_train_type" not in columns:
+            # Same position as in a full run
+            position = columns.index("transformed_info_message") + 1 if "transformed_info_message" in columns else len(columns)
+            columns = columns[:position] + ["final_train_type"] + columns[position:]
+        stage_cache = None if args.no_cache else StageCache(args.cache_dir)
+        stages = build_stages(executor, columns, args.train_types)
+        train_df = run_stages(args.input, stages, stage_cache, args.stage_threads, columns)
+        write_output(train_df, args.output)
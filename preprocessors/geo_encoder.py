@@ -1,105 +1,80 @@
-import requests
 import time
 import os
 import pandas as pd
 import numpy as np
 from preprocessors.preprocessor import Preprocessor
+from utils.geocoding import GeocodingCache, HereGeocoder
+from utils.station_index import StationCoordinateIndex, StationNameIndex
 
 
 class GeoEncoder(Preprocessor):
-    def __init__(self, name="GeoEncoder") -> None:
-        super().__init__(name)
+    input_files = ["train_stations_europe.csv", "station_coordinates_final_manually_updated.csv"]
+    reads = ["ID_Base", "stop_number", "IBNR", "starting_station_IBNR", "last_station", "lat", "long"]
+    writes = ["IBNR", "lat", "long", "clear_station_name"]
 
-    def get_coordinates_here(self, station_name, api_key):
-        url = f"https://geocode.search.hereapi.com/v1/geocode?q={station_name}&apiKey={api_key}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            if data['items']:
-                location = data['items'][0]['position']
-                return location['lat'], location['lng']
-        return None, None
-    
-    def update_lat_long(self, row, api_key):
-        # Only update if lat or long is NaN
-        if pd.isna(row['lat']) or pd.isna(row['long']):
-            lat, long = self.get_coordinates_here(row['clear_station_name'], api_key)
-            # Replace lat and long with the new coordinates
-            row['lat'] = lat
-            row['long'] = long
-        return row
+    def __init__(self, name="GeoEncoder", geocoder=None, station_index=None, name_index=None) -> None:
+        super().__init__(name)
+        self.station_index = station_index or StationCoordinateIndex()
+        self.name_index = name_index or StationNameIndex()
+        # Created on first use so runs without missing coordinates never open the cache
+        self.geocoder = geocoder
+
+    def get_geocoder(self):
+        if self.geocoder is None:
+            self.geocoder = HereGeocoder(os.environ.get("HERE_API_KEY"), GeocodingCache())
+        return self.geocoder
+
+    def update_lat_long(self, df):
+        """Geocodes every unique station name of the rows with a missing lat or long."""
+        missing = df['lat'].isna() | df['long'].isna()
+        station_names = df.loc[missing, 'clear_station_name']
+        unique_names = station_names.dropna().unique()
+        if len(unique_names) == 0:
+            return df
+
+        self.logger.info(f"Geocode {len(unique_names)} unique station names")
+        coordinates = self.get_geocoder().geocode_all(unique_names)
+        # Replace lat and long with the new coordinates
+        df.loc[missing, 'lat'] = station_names.map({name: lat for name, (lat, _) in coordinates.items()}).astype(float)
+        df.loc[missing, 'long'] = station_names.map({name: long for name, (_, long) in coordinates.items()}).astype(float)
+        return df
 
     def transform(self, df):
         self.logger.info("Start Preprocessing")
-        self.logger.info("Load European IBNR data")
         df.loc[df['stop_number'] == 1, 'IBNR'] = df['starting_station_IBNR']
-        df = df.astype({"IBNR": "float"})
-        european_train_stations = pd.read_csv("train_stations_europe.csv")
-        european_train_stations.rename(columns={"uic": "IBNR", "longitude": "long", "latitude": "lat"}, inplace=True)
-        european_train_stations = european_train_stations[european_train_stations["country"]=="DE"]
-
-        self.logger.info("Filter out missing long lats")
-        df_missing_lat_long = df[df['lat'].isna() | df['long'].isna()]
-
-        self.logger.info("Process missing long lats sequentially in chunks")
-        
-        n_chunks = 10
-        chunks = np.array_split(df_missing_lat_long, n_chunks)
-
-        for i, chunk in enumerate(chunks):
-            print(f"Processing chunk {i + 1}/{n_chunks}...")
-
-            merged_chunk = chunk.merge(
-                european_train_stations[['IBNR', 'lat', 'long']],
-                on='IBNR', how='left', suffixes=('', '_european_train_stations')
-            )
-
-            # Replace NaN lat/long in the original dataframe (df_train_rides) for the current chunk
-            df.loc[chunk.index, 'lat'] = df.loc[chunk.index, 'lat'].fillna(merged_chunk['lat_european_train_stations'])
-            df.loc[chunk.index, 'long'] = df.loc[chunk.index, 'long'].fillna(merged_chunk['long_european_train_stations'])
+        df = df.astype({"IBNR": "Int64"})
 
+        self.logger.info("Look up missing long lats in the European IBNR index")
+        missing = df['lat'].isna() | df['long'].isna()
+        lat, long = self.station_index.lookup(df.loc[missing, 'IBNR'])
+        df.loc[missing, 'lat'] = df.loc[missing, 'lat'].fillna(pd.Series(lat, index=df.index[missing]))
+        df.loc[missing, 'long'] = df.loc[missing, 'long'].fillna(pd.Series(long, index=df.index[missing]))
         self.logger.info("Retrieved missing coordinates")
-        df.to_csv("DBtrainrides_replaced_missing_coordinates.csv", index=False)
-
-        preprocessed_df = pd.read_csv("station_coordinates_final_manually_updated.csv")
 
         incomplete_df = df[df[["lat","long"]].isna().all(axis=1)]
         df_sorted = incomplete_df.sort_values(by=['ID_Base', 'stop_number'])
 
         # Shift the 'last_station' within each 'ID_Base' to get the next stop's 'last_station' in the current row
-        df_sorted['clear_station_name'] = df_sorted.groupby('ID_Base')['last_station'].shift(-1)
-        merged = pd.merge(
-            df_sorted, preprocessed_df,
-            on='clear_station_name',
-            how='left',
-            suffixes=('_original', '_new')
-        )
-
-        # Replace NaN values in 'long' and 'lat' using the values from the second DataFrame
-        merged['long'] = merged['long_original'].combine_first(merged['long_new'])
-        merged['lat'] = merged['lat_original'].combine_first(merged['lat_new'])
-
-        # Drop intermediate columns
-        result = merged.drop(columns=['long_original', 'long_new', 'lat_original', 'lat_new'])
-
-        api_key = os.environ.get("HERE_API_KEY")
-
-        result = result.apply(self.update_lat_long, axis=1, api_key=api_key)
-        result.to_csv("test.csv",index=False)
-
-        missing_long_lat_after_second_cleaning = result[(
-                                                    (result['lat'].isna()) &
-                                                    (result['long'].isna()))]
-
-        missing_long_lat_after_second_cleaning = missing_long_lat_after_second_cleaning.apply(self.update_lat_long, axis=1, api_key=api_key)
-
-        combined_df = pd.concat([result, missing_long_lat_after_second_cleaning])
-
-        final_result_df = combined_df.drop_duplicates(subset=['ID_Base', 'ID_Timestamp', 'stop_number'])
-
-        combined_df_all_rides = pd.concat([df, final_result_df])
-
-        final_result_df_all_rides = combined_df_all_rides.drop_duplicates(subset=['ID_Base', 'ID_Timestamp', 'stop_number'])
+        df['clear_station_name'] = pd.Series(np.nan, index=df.index, dtype="object")
+        df.loc[df_sorted.index, 'clear_station_name'] = df_sorted.groupby('ID_Base')['last_station'].shift(-1)
+
+        # Resolve the station names offline against the manually updated coordinates and the European station names
+        station_names = df.loc[incomplete_df.index, 'clear_station_name']
+        unique_names = station_names.dropna().unique()
+        if len(unique_names) > 0:
+            resolved = self.name_index.resolve(unique_names)
+            unresolved = resolved.index[resolved['lat'].isna()]
+            self.logger.info(
+                f"Resolved {len(resolved) - len(unresolved)} of {len(resolved)} station names offline, "
+                f"mean confidence {resolved['confidence'].mean():.2f}"
+            )
+            if len(unresolved) > 0:
+                self.logger.info(f"Unresolved station names: {', '.join(map(str, unresolved[:20]))}")
+            df.loc[incomplete_df.index, 'long'] = station_names.map(resolved['long'])
+            df.loc[incomplete_df.index, 'lat'] = station_names.map(resolved['lat'])
+
+        # The HERE API is only the last resort for the unresolved names
+        # Failed requests are already retried by the geocoder, so a second pass is not needed
+        df = self.update_lat_long(df)
         self.logger.info("Finalize Preprocessing")
-        final_result_df_all_rides.to_csv("DBtrainrides_restored_lat_long.csv",index=False)
-        return final_result_df_all_rides
\ No newline at end of file
+        return df
@@ -7,26 +7,32 @@ from preprocessors.preprocessor import Preprocessor
 
 
 class InfoMessageCleaner(Preprocessor):
+    reads = ["info"]
+    writes = ["info_present", "transformed_info_message"]
+
     def __init__(self, name="InfoMessageCleaner") -> None:
         super().__init__(name)
 
     def check_info(self, df):
         """Checks if an info message is present and produces a boolean attribute for the dataframe."""
 
-        df["info_present"] = False
-        for index, row in df.iterrows():
-            if pd.notna(row["info"]):
-                df.at[index, "info_present"] = True
+        df["info_present"] = df["info"].notna()
 
     def transform_info_message(self, df):
-        """Clean the info messages if present or add a dummy string and add the values as a new attribute into the dataframe."""
-
-        df["transformed_info_message"] = "No message"
-        for index, row in df.iterrows():
-            if pd.notna(row["info"]):
-                df.at[index, "transformed_info_message"] = re.sub(
-                    r"\.\s*\(.*?\)", "", row["info"]
-                )
+        """Clean the info messages if present or add a dummy string and add the values as a new attribute into the dataframe.
+
+        There are only a few hundred distinct messages, so they are interned as a
+        categorical and the regex is applied once per distinct message. The
+        result is a categorical with the cleaned messages as categories.
+        """
+
+        messages = df["info"].astype("category")
+        cleaned = [re.sub(r"\.\s*\(.*?\)", "", message) for message in messages.cat.categories]
+        # Missing messages have the code -1, which picks the dummy string appended last
+        codes, categories = pd.factorize(pd.Index(cleaned + ["No message"], dtype="object"))
+        df["transformed_info_message"] = pd.Categorical.from_codes(
+            codes[messages.cat.codes.to_numpy()], categories=categories
+        )
 
     def compute_statistics(self, df):
         """Computes matrix for statistics in terms of relation between a present info and a potential delay."""
@@ -40,13 +46,11 @@ class InfoMessageCleaner(Preprocessor):
         self.logger.info("Preprocess data")
         self.check_info(dataframe)
         self.transform_info_message(dataframe)
-        self.logger.info("Save the data")
-        dataframe.to_csv("DBtrainrides_info_cleaned.csv", index=False)
 
         return dataframe
 
     def visualize_statistics(self, df):
-        mean_delay = df.groupby("transformed_info_message")["arrival_delay_m"].mean()
+        mean_delay = df.groupby("transformed_info_message", observed=True)["arrival_delay_m"].mean()
 
         plt.figure(figsize=(10, 6))
         mean_delay.plot(kind="bar", color="skyblue")
@@ -1,12 +1,30 @@
 from preprocessors.preprocessor import Preprocessor
+from utils.journey_kernels import journey_offsets, delay_features, schedule_features, distance_features
 import numpy as np
 import pandas as pd
-from datetime import datetime
+from utils.utils import parse_id_timestamps
 
 
 class LagInfoExtractor(Preprocessor):
-    def __init__(self, name="LagInfoExtractor") -> None:
+    # Features that are computed together
+    DELAY_FEATURES = ["prev_arrival_delay_m", "prev_departure_delay_m", "weighted_avg_prev_delay", "cumulative_delay", "delay_gain"]
+    PROGRESS_FEATURES = ["max_station_number", "station_progress"]
+    TIME_FEATURES = [
+        "origin_departure_plan", "planned_elapsed_time", "total_planned_time", "time_progress",
+        "next_arrival_plan", "planned_travel_time_to_next_stop", "progress_ratio",
+    ]
+    DISTANCE_FEATURES = ["distance_to_prev_stop", "distance_from_origin", "total_distance", "distance_to_next_stop", "distance_progress"]
+    CITY_FEATURES = ["avg_city_delay"]
+
+    def __init__(self, name="LagInfoExtractor", executor=None, features=None) -> None:
         super().__init__(name)
+        # Optional JourneyShardExecutor to run the per-journey features in parallel
+        self.executor = executor
+        # Features that are used later, None for all. The groups of features nobody uses are not computed.
+        self.features = None if features is None else set(features)
+
+    def computes(self, group):
+        return self.features is None or not self.features.isdisjoint(group)
 
     def convert_df(self, df):
         # Convert 'station_number' to numeric
@@ -18,23 +36,10 @@ class LagInfoExtractor(Preprocessor):
 
         # Ensure 'arrival_delay_m' and 'departure_delay_m' are numeric
         df["arrival_delay_m"] = pd.to_numeric(df["arrival_delay_m"], errors="coerce")
-        df["departure_delay_m"] = pd.to_numeric(
-            df["departure_delay_m"], errors="coerce"
-        )
-
-    def parse_departure_time(self, departure_time_str):
-        if not isinstance(departure_time_str, str) or len(departure_time_str) != 10:
-            return None
-        try:
-            year = int("20" + departure_time_str[0:2])  # Assuming years are 2020+
-            month = int(departure_time_str[2:4])
-            day = int(departure_time_str[4:6])
-            hour = int(departure_time_str[6:8])
-            minute = int(departure_time_str[8:10])
-            dt = datetime(year, month, day, hour, minute)
-        except ValueError:
-            dt = None
-        return dt
+        if "departure_delay_m" in df:
+            df["departure_delay_m"] = pd.to_numeric(
+                df["departure_delay_m"], errors="coerce"
+            )
 
     def calculate_weighted_avg_delay_vectorized(self, group):
         delays = group["arrival_delay_m"].fillna(0).values
@@ -95,12 +100,127 @@ class LagInfoExtractor(Preprocessor):
 
         return group
 
-    def transform(self, df):
-        self.logger.info("Preprocess data")
-        df["departure_time"] = df["ID_Timestamp"].apply(self.parse_departure_time)
-        self.convert_df(df)
-        df = df.sort_values(by=["ID_Base", "ID_Timestamp", "stop_number"])
-        df.reset_index(drop=True, inplace=True)
+    def haversine_to_prev(self, df):
+        """Distance in kilometres between every stop and the row before it."""
+        R = 6371  # Earth radius in kilometers
+        lat_rad = np.radians(df["lat"].values)
+        lon_rad = np.radians(df["long"].values)
+        distances = np.zeros(len(df))
+        if len(df) > 1:
+            # Same operations as in calculate_distance_features_vectorized, over all rows at once
+            delta_phi = np.diff(lat_rad)
+            delta_lambda = np.diff(lon_rad)
+            a = (
+                np.sin(delta_phi / 2.0) ** 2
+                + np.cos(lat_rad[:-1])
+                * np.cos(lat_rad[1:])
+                * np.sin(delta_lambda / 2.0) ** 2
+            )
+            c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            distances[1:] = R * c
+        return distances
+
+    def transform_journeys(self, df):
+        """Computes all features that only depend on the stops of the same journey.
+
+        The frame has to be sorted by journey and stop number. Every feature is
+        computed by a segmented kernel over the journey offsets, the result is
+        identical to transform_journeys_groupby.
+        """
+        # Journeys without a valid departure time are dropped by groupby
+        valid = df["departure_time"].notna()
+        if not valid.all():
+            df = df[valid].copy()
+
+        offsets = journey_offsets(df["ID_Base"].values, df["departure_time"].values)
+        if self.computes(self.DELAY_FEATURES):
+            (
+                df["prev_arrival_delay_m"],
+                df["prev_departure_delay_m"],
+                df["weighted_avg_prev_delay"],
+                df["cumulative_delay"],
+                df["delay_gain"],
+            ) = delay_features(
+                df["arrival_delay_m"].to_numpy(dtype="float64"),
+                df["departure_delay_m"].to_numpy(dtype="float64"),
+                offsets,
+            )
+
+        if self.computes(self.PROGRESS_FEATURES + self.TIME_FEATURES):
+            df = self.add_schedule_features(df, offsets)
+
+        df["long"] = pd.to_numeric(df["long"], errors="coerce")
+        df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
+
+        # Remove entries with missing coordinates
+        df = df.dropna(subset=["long", "lat"]).copy()
+
+        if self.computes(self.DISTANCE_FEATURES):
+            df = self.add_distance_features(df)
+        return df
+
+    def add_schedule_features(self, df, offsets):
+        max_stop_numbers, origin_departures, last_arrivals, next_arrivals = schedule_features(
+            df["stop_number"].to_numpy(),
+            df["departure_plan"].values.view("int64"),
+            df["arrival_plan"].values.view("int64"),
+            offsets,
+        )
+        df["max_station_number"] = max_stop_numbers
+        df["station_progress"] = df["stop_number"] / df["max_station_number"]
+        if not self.computes(self.TIME_FEATURES):
+            return df
+        df["origin_departure_plan"] = origin_departures.view("datetime64[ns]")
+
+        # Calculate planned elapsed time since departure from origin station
+        df['planned_elapsed_time'] = (df['arrival_plan'] - df['departure_time']).dt.total_seconds() / 60  # in minutes
+
+        # Calculate total planned time for the journey
+        last_arrival_plan = pd.Series(last_arrivals.view("datetime64[ns]"), index=df.index)
+        df['total_planned_time'] = (last_arrival_plan - df['departure_time']).dt.total_seconds() / 60  # in minutes
+
+        # Calculate ratio of elapsed time to total time
+        df["time_progress"] = df["planned_elapsed_time"] / df["total_planned_time"]
+
+        # Calculate planned travel time to the next stop
+        df["next_arrival_plan"] = next_arrivals.view("datetime64[ns]")
+        df["planned_travel_time_to_next_stop"] = (
+            df["next_arrival_plan"] - df["departure_plan"]
+        ).dt.total_seconds() / 60  # in minutes
+
+        # Calculate the ratio of station progress to time progress (progress_ratio = station_progress / time_progress)
+        df["progress_ratio"] = df["station_progress"] / df["time_progress"].replace(
+            {0: np.nan}
+        )
+
+        # Handle infinite or NaN values
+        df["progress_ratio"] = (
+            df["progress_ratio"].replace([np.inf, -np.inf], np.nan).fillna(0)
+        )
+        return df
+
+    def add_distance_features(self, df):
+        offsets = journey_offsets(df["ID_Base"].values, df["departure_time"].values)
+        (
+            df["distance_to_prev_stop"],
+            df["distance_from_origin"],
+            df["total_distance"],
+            df["distance_to_next_stop"],
+        ) = distance_features(self.haversine_to_prev(df), offsets)
+
+        # Calculate ratio of distance from origin to total distance
+        df["distance_progress"] = df["distance_from_origin"] / df[
+            "total_distance"
+        ].replace({0: np.nan})
+
+        # Handle infinite or NaN values
+        df["distance_progress"] = (
+            df["distance_progress"].replace([np.inf, -np.inf], np.nan).fillna(0)
+        )
+        return df
+
+    def transform_journeys_groupby(self, df):
+        """Reference implementation of transform_journeys with one groupby(...).apply per journey."""
         # Group the data by journey
         df["prev_arrival_delay_m"] = df.groupby(["ID_Base", "departure_time"])[
             "arrival_delay_m"
@@ -180,10 +300,24 @@ class LagInfoExtractor(Preprocessor):
         df["distance_progress"] = (
             df["distance_progress"].replace([np.inf, -np.inf], np.nan).fillna(0)
         )
-        city_avg_delay = df.groupby("city")["arrival_delay_m"].transform("mean")
+        return df
+
+    def transform(self, df):
+        self.logger.info("Preprocess data")
+        df["departure_time"] = parse_id_timestamps(df["ID_Timestamp"])
+        self.convert_df(df)
+        df = df.sort_values(by=["ID_Base", "ID_Timestamp", "stop_number"])
+        df.reset_index(drop=True, inplace=True)
+
+        if self.executor is None:
+            df = self.transform_journeys(df)
+        else:
+            df = self.executor.map(self.transform_journeys, df)
+
+        if self.computes(self.CITY_FEATURES):
+            city_avg_delay = df.groupby("city")["arrival_delay_m"].transform("mean")
 
-        # Add the average city delay as a feature
-        df["avg_city_delay"] = city_avg_delay
+            # Add the average city delay as a feature
+            df["avg_city_delay"] = city_avg_delay
         self.logger.info("Finalize preprocessing")
-        df.to_csv("DBtrainrides_optimized.csv", index=False)
         return df
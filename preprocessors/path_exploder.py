@@ -1,13 +1,80 @@
 from preprocessors.preprocessor import Preprocessor
-from utils.utils import df_converter
+from utils.schema import apply_schema
 
+import numpy as np
 import pandas as pd
 
+# Columns that only belong to the stop rows and not to the journey rows, and vice versa
+STOP_COLUMNS = [
+    "station",
+    "state",
+    "long",
+    "lat",
+    "category",
+    "arrival_plan",
+    "departure_plan",
+    "arrival_change",
+    "departure_change",
+    "arrival_delay_m",
+    "departure_delay_m",
+    "info",
+    "arrival_delay_check",
+    "departure_delay_check",
+]
+JOURNEY_COLUMNS = [
+    "station",
+    "zip",
+    "state",
+    "city",
+    "category",
+    "line",
+    "path",
+    "eva_nr",
+    "arrival_delay_check",
+    "departure_delay_check",
+]
+
+
+class StationDictionary:
+    """Interns normalized station names to integer IDs, built once from ibnr_stations_index.csv.
+
+    The remaining columns of the index (the IBNR) are kept as arrays indexed
+    by station ID.
+    """
+
+    def __init__(self, path="ibnr_stations_index.csv"):
+        index_df = pd.read_csv(path)
+        names = index_df["Station Name"].str.strip().str.lower()
+        # The first entry wins for names that occur more than once
+        first = ~names.duplicated()
+        self.ids = pd.Index(names[first])
+        self.attributes = index_df.drop(columns=["Station Name"])[first.to_numpy()].reset_index(drop=True)
+
+    def lookup(self, normalized_names):
+        """Returns the station ID of every name, -1 for unknown names."""
+        return self.ids.get_indexer(normalized_names)
+
 
 class PathExploder(Preprocessor):
+    input_files = ["ibnr_stations_index.csv"]
 
     def __init__(self, name="PathExploder") -> None:
         super().__init__(name)
+        self.station_dictionary = None
+
+    def tokenize_paths(self, paths):
+        """Splits all paths into one flat token array with the offsets of every path.
+
+        Missing paths produce a single missing token, like explode does.
+        """
+        has_path = paths.notna().to_numpy()
+        counts = np.ones(len(paths), dtype=np.int64)
+        counts[has_path] = paths[has_path].str.count(r"\|").to_numpy() + 1
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        tokens = np.full(offsets[-1], np.nan, dtype=object)
+        tokens[np.repeat(has_path, counts)] = "|".join(paths[has_path]).split("|")
+        return tokens, offsets
 
     def transform(self, df):
         self.logger.info("Split up ID")
@@ -15,6 +82,8 @@ class PathExploder(Preprocessor):
             "-", n=2, expand=True
         )
         df["ID_Stop_Number"] = pd.to_numeric(df["ID_Stop_Number"])
+        # Journeys are grouped and sorted by the integer IDs
+        df = df.astype({"ID_Base": "int64", "ID_Timestamp": "int64"})
 
         df.drop(columns=["ID"], inplace=True)
         new_column_order = ["ID_Base", "ID_Timestamp", "ID_Stop_Number"] + [
@@ -22,124 +91,76 @@ class PathExploder(Preprocessor):
             for col in df.columns
             if col not in ["ID_Base", "ID_Timestamp", "ID_Stop_Number"]
         ]
-        df = df[new_column_order]
-        df_copy = df.copy()
-
-        df.rename(columns={"eva_nr": "starting_station_IBNR"}, inplace=True)
-        df.drop(
-            columns=[
-                "station",
-                "state",
-                "long",
-                "lat",
-                "category",
-                "arrival_plan",
-                "departure_plan",
-                "arrival_change",
-                "departure_change",
-                "arrival_delay_m",
-                "departure_delay_m",
-                "info",
-                "arrival_delay_check",
-                "departure_delay_check",
-            ],
-            inplace=True,
-        )
-        max_stop_numbers_df = (
-            df.loc[df.groupby(["ID_Base", "ID_Timestamp"])["ID_Stop_Number"].idxmax()]
-            .drop_duplicates(subset=["ID_Base", "ID_Timestamp"], keep="first")
+        df = df[new_column_order].reset_index(drop=True)
+
+        # One row per journey, the stop with the highest number holds the complete path
+        journey_codes = df.groupby(["ID_Base", "ID_Timestamp"]).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        max_stop_rows = df.groupby(["ID_Base", "ID_Timestamp"])["ID_Stop_Number"].idxmax()
+        journeys_df = (
+            df.loc[max_stop_rows, [col for col in df.columns if col not in STOP_COLUMNS]]
+            .rename(columns={"eva_nr": "starting_station_IBNR"})
             .sort_values(by=["starting_station_IBNR", "ID_Base", "ID_Timestamp"])
         )
-        max_stop_numbers_df = max_stop_numbers_df.assign(
-            last_station=max_stop_numbers_df["path"].str.split("|")
-        )
+
+        self.logger.info("Explode paths")
+        tokens, offsets = self.tokenize_paths(journeys_df["path"])
+        counts = np.diff(offsets)
+        journey_positions = np.repeat(np.arange(len(journeys_df)), counts)
+        stop_numbers = np.arange(len(tokens), dtype=np.int64) - offsets[journey_positions] + 1
+
+        # Normalize and intern every distinct station name once
+        if self.station_dictionary is None:
+            self.station_dictionary = StationDictionary()
+        token_codes, unique_tokens = pd.factorize(tokens)
+        normalized = pd.Index(unique_tokens, dtype=object).str.strip().str.lower()
+        station_ids = self.station_dictionary.lookup(normalized)
+        station_ids = np.where(token_codes >= 0, station_ids[token_codes], -1)
+
         exploded_stations_df = (
-            max_stop_numbers_df.explode("last_station")
-            .drop(columns=["path"])
-            .assign(
-                stop_number=lambda df: df.groupby(
-                    ["ID_Base", "ID_Timestamp"]
-                ).cumcount()
-                + 1
-            )
-            .sort_values(
-                by=["starting_station_IBNR", "ID_Base", "ID_Timestamp", "stop_number"]
-            )
+            journeys_df.drop(columns=["ID_Stop_Number", "path"])
+            .take(journey_positions)
             .reset_index(drop=True)
         )
-        ibnr_index_df = pd.read_csv("ibnr_stations_index.csv")
-        exploded_stations_df["last_station"] = (
-            exploded_stations_df["last_station"].str.strip().str.lower()
-        )
-        ibnr_index_df["Station Name"] = (
-            ibnr_index_df["Station Name"].str.strip().str.lower()
-        )
-        exploded_stations_df_with_ibnr_df = exploded_stations_df.merge(
-            ibnr_index_df, how="left", left_on="last_station", right_on="Station Name"
-        ).drop(columns=["ID_Stop_Number", "Station Name"])
-        exploded_stations_df_with_ibnr_df["last_station"] = (
-            exploded_stations_df_with_ibnr_df["last_station"].replace("", pd.NA)
-        )
-        exploded_stations_df_with_no_ibnr_df = exploded_stations_df_with_ibnr_df[
-            exploded_stations_df_with_ibnr_df["last_station"].isna()
-        ]
-        df_copy["canceled"] = df_copy["path"].isna().astype(bool)
-        # Drop unnecessary columns from train_rides_df_copy
-        df_copy.drop(
-            columns=[
-                "station",
-                "zip",
-                "state",
-                "city",
-                "category",
-                "line",
-                "path",
-                "eva_nr",
-                "arrival_delay_check",
-                "departure_delay_check",
-            ],
-            inplace=True,
-        )
-        # Merge with exploded_stations_df_with_ibnr_df on relevant keys
-        exploded_stations_df_with_ibnr_time_df = (
-            exploded_stations_df_with_ibnr_df.merge(
-                df_copy,
-                left_on=["ID_Base", "ID_Timestamp", "stop_number"],
-                right_on=["ID_Base", "ID_Timestamp", "ID_Stop_Number"],
-                how="left",
-            ).sort_values(by=["starting_station_IBNR", "ID_Base", "ID_Timestamp"])
-        )
-        # Drop duplicate column and reorder columns
-        exploded_stations_df_with_ibnr_time_df = (
-            exploded_stations_df_with_ibnr_time_df.drop("ID_Stop_Number", axis=1)
+        last_station = pd.Series(normalized.take(token_codes), dtype=object)
+        last_station[token_codes < 0] = np.nan
+        exploded_stations_df["last_station"] = last_station.replace("", pd.NA)
+        exploded_stations_df.insert(
+            exploded_stations_df.columns.get_loc("ID_Timestamp") + 1, "stop_number", stop_numbers
         )
+        station_attributes = self.station_dictionary.attributes.reindex(station_ids).reset_index(drop=True)
+        exploded_stations_df = pd.concat([exploded_stations_df, station_attributes], axis=1)
 
-        # Place 'stop_number' after 'ID_Timestamp'
-        columns = exploded_stations_df_with_ibnr_time_df.columns.tolist()
-        columns.remove("stop_number")
-        columns.insert(columns.index("ID_Timestamp") + 1, "stop_number")
-        exploded_stations_df_with_ibnr_time_df = exploded_stations_df_with_ibnr_time_df[
-            columns
-        ]
+        # Align every exploded stop with the input row of the same journey and stop number by position
+        self.logger.info("Align stops")
+        stop_rows_df = df[[col for col in df.columns if col not in JOURNEY_COLUMNS]]
+        stop_rows_df = stop_rows_df.assign(canceled=df["path"].isna().astype(bool))
+        stop_number_range = int(max(np.nanmax(df["ID_Stop_Number"].to_numpy(dtype="float64")), len(tokens))) + 1
+        valid = (journey_codes >= 0) & df["ID_Stop_Number"].notna().to_numpy()
+        row_keys = np.where(
+            valid,
+            journey_codes * stop_number_range + df["ID_Stop_Number"].fillna(0).to_numpy(dtype=np.int64),
+            -1,
+        )
+        order = np.argsort(row_keys, kind="stable")
+        sorted_keys = row_keys[order]
+        stop_keys = journey_codes[journeys_df.index.to_numpy()][journey_positions]
+        stop_keys = stop_keys * stop_number_range + stop_numbers
+        positions = np.minimum(np.searchsorted(sorted_keys, stop_keys), len(sorted_keys) - 1)
+        input_rows = np.where(sorted_keys[positions] == stop_keys, order[positions], -1)
 
-        # Sort by relevant columns
-        exploded_stations_df_with_ibnr_time_df = (
-            exploded_stations_df_with_ibnr_time_df.sort_values(
-                by=["starting_station_IBNR", "ID_Base", "ID_Timestamp"]
-            )
+        stop_rows_df = (
+            stop_rows_df.drop(columns=["ID_Base", "ID_Timestamp", "ID_Stop_Number"])
+            .reindex(input_rows)
+            .reset_index(drop=True)
         )
+        exploded_stations_df_with_ibnr_time_df = pd.concat([exploded_stations_df, stop_rows_df], axis=1)
 
         # Replace NA with False in canceled
         exploded_stations_df_with_ibnr_time_df["canceled"] = (
             exploded_stations_df_with_ibnr_time_df["canceled"].fillna(False)
         )
-        exploded_stations_df_with_ibnr_time_df = df_converter(
+        exploded_stations_df_with_ibnr_time_df = apply_schema(
             exploded_stations_df_with_ibnr_time_df
         )
-
-        self.logger.info("Save the data")
-        exploded_stations_df_with_ibnr_time_df.to_csv(
-            "DBtrainrides_exploded_stations.csv", index=False
-        )
         self.logger.info("Finalize the preprocessing")
         return exploded_stations_df_with_ibnr_time_df
@@ -1,8 +1,25 @@
 import logging
 
+from utils.instrumentation import instrumented
+
 
 class Preprocessor:
+    # Files read by the stage besides its input dataframe, used to key the stage cache
+    input_files = []
+    # Columns the stage reads and writes. A stage that declares them gets only these columns and must keep
+    # the rows of the frame, so it can run at the same time as stages that touch other columns (utils/pipeline.py)
+    reads = None
+    writes = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every stage call is measured, see utils/instrumentation.py
+        for method in ("transform", "transform_df"):
+            if method in cls.__dict__:
+                setattr(cls, method, instrumented(cls.__dict__[method]))
+
     def __init__(self, name="Preprocessor") -> None:
+        self.name = name
         # Set up the logger with the given name
         self.logger = logging.getLogger(name)
 
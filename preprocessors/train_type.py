@@ -1,15 +1,28 @@
-from datetime import datetime
+import os
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from preprocessors.preprocessor import Preprocessor
+from utils.journey_kernels import journey_offsets
+from utils.utils import parse_id_timestamps
+
+LINE_CATEGORIES = ["No Prefix", "RE/RB Prefix", "Other Prefix"]
+TRAIN_TYPES = ["Regional Train", "Tram"]
 
 
 class TrainTypeClassifier(Preprocessor):
-    def __init__(self, name="TrainTypeClassifier") -> None:
+    # As a stage of main.py only the train type is added, the rows are kept
+    reads = ["ID_Base", "ID_Timestamp", "stop_number", "line", "lat", "long"]
+    writes = ["final_train_type"]
+
+    def __init__(self, name="TrainTypeClassifier", write_splits=False, plot=False, output_dir=".") -> None:
         super().__init__(name)
+        # The CSV files of the classified, regional and tram rows and the histogram are only written on request
+        self.write_splits = write_splits
+        self.plot = plot
+        self.output_dir = output_dir
 
     def categorize_line(self, line):
         if pd.isnull(line) or line.strip() == "":
@@ -24,21 +37,10 @@ class TrainTypeClassifier(Preprocessor):
             return "Other Prefix"
 
     def determine_line_prefix(self, df):
-        df["line_prefix"] = df["line"].str.extract(r"^([A-Za-z]+)", expand=False)
-
-    def parse_departure_time(self, departure_time_str):
-        if not isinstance(departure_time_str, str) or len(departure_time_str) != 10:
-            return None
-        try:
-            year = int("20" + departure_time_str[0:2])  # Assuming years are 2020+
-            month = int(departure_time_str[2:4])
-            day = int(departure_time_str[4:6])
-            hour = int(departure_time_str[6:8])
-            minute = int(departure_time_str[8:10])
-            dt = datetime(year, month, day, hour, minute)
-        except ValueError:
-            dt = None
-        return dt
+        # The prefix is extracted once per distinct line, missing lines have the code -1 and get NaN
+        codes, uniques = pd.factorize(df["line"])
+        prefixes = pd.Series(np.asarray(uniques, dtype=object), dtype=object).str.extract(r"^([A-Za-z]+)", expand=False)
+        df["line_prefix"] = np.append(prefixes.to_numpy(dtype=object), np.nan)[codes]
 
     def haversine_vectorised(self, lat1, lon1, lat2, lon2):
         # Earth radius in kilometres
@@ -100,13 +102,98 @@ class TrainTypeClassifier(Preprocessor):
         else:
             return row["train_type"]
 
+    def categorize_lines(self, lines):
+        """categorize_line of every row, evaluated once per distinct line."""
+        codes, uniques = pd.factorize(lines)
+        categories = [self.categorize_line(line) for line in np.asarray(uniques, dtype=object)]
+        # Missing lines have the code -1, which picks the category appended last
+        category_codes = pd.Index(LINE_CATEGORIES).get_indexer(categories + ["No Prefix"])
+        return pd.Series(
+            pd.Categorical.from_codes(category_codes[codes], categories=LINE_CATEGORIES), index=lines.index
+        )
+
+    def average_distances(self, df, departure_time):
+        """Mean distance from every stop to the next stop of its journey, like compute_average_distance.
+
+        The last stop of a journey counts with a distance of 0. Stops without
+        coordinates or departure time are left out and get NaN.
+        """
+        valid = (departure_time.notna() & df["lat"].notna() & df["long"].notna()).to_numpy()
+        stops = pd.DataFrame({
+            "ID_Base": df["ID_Base"].to_numpy()[valid],
+            "departure_time": departure_time.to_numpy()[valid],
+            "stop_number": df["stop_number"].to_numpy()[valid],
+            "lat": df["lat"].to_numpy(dtype="float64")[valid],
+            "long": df["long"].to_numpy(dtype="float64")[valid],
+        }, index=df.index[valid]).sort_values(by=["ID_Base", "departure_time", "stop_number"], kind="stable")
+        if len(stops) == 0:
+            return pd.Series(np.nan, index=df.index)
+
+        offsets = journey_offsets(stops["ID_Base"].values, stops["departure_time"].values)
+        lat, long = stops["lat"].to_numpy(), stops["long"].to_numpy()
+        distances = np.zeros(len(stops))
+        distances[:-1] = self.haversine_vectorised(lat[:-1], long[:-1], lat[1:], long[1:])
+        # The last stop of every journey has no next stop
+        distances[offsets[1:] - 1] = 0
+        counts = np.diff(offsets)
+        averages = np.add.reduceat(distances, offsets[:-1]) / counts
+        return pd.Series(np.repeat(averages, counts), index=stops.index).reindex(df.index)
+
+    def classify(self, df, departure_time=None):
+        """Returns the line category, the average distance between the stops and the train type of every row."""
+        if departure_time is None:
+            departure_time = parse_id_timestamps(df["ID_Timestamp"])
+        line_category = self.categorize_lines(df["line"])
+        avg_distance = self.average_distances(df, departure_time)
+        # Same as classify_train_type with the default threshold, a missing distance is no tram
+        train_type = pd.Categorical.from_codes((avg_distance <= 3).to_numpy(dtype=np.int8), categories=TRAIN_TYPES)
+        final_train_type = pd.Series(train_type, index=df.index)
+        # Same as final_classification: a line category that is a train type wins
+        from_line = line_category.isin(TRAIN_TYPES)
+        final_train_type[from_line] = line_category[from_line].astype(str)
+        return line_category, avg_distance, pd.Series(train_type, index=df.index), final_train_type
+
+    def transform(self, df):
+        self.logger.info("Classify train types")
+        df["final_train_type"] = self.classify(df)[3]
+        return df
+
     def transform_df(self, dataframe):
         self.logger.info("Preprocess data")
+        dataframe["departure_time"] = parse_id_timestamps(dataframe["ID_Timestamp"])
+
+        # Drop rows with missing coordinates and sort by necessary columns
+        dataframe = dataframe.dropna(subset=["long", "lat"])
+        dataframe = dataframe.sort_values(
+            by=["ID_Base", "departure_time", "stop_number"]
+        )
+
+        self.logger.info("Compute Final Train Type")
+        (
+            dataframe["line_category"],
+            dataframe["avg_distance_between_stops"],
+            dataframe["train_type"],
+            dataframe["final_train_type"],
+        ) = self.classify(dataframe, dataframe["departure_time"])
+        self.determine_line_prefix(dataframe)
+
+        if self.write_splits:
+            self.logger.info("Split grouped data and save it")
+            dataframe.to_csv(os.path.join(self.output_dir, "DBtrainrides_final_train_type.csv"), index=False)
+            dataframe[dataframe["final_train_type"] == "Regional Train"].to_csv(
+                os.path.join(self.output_dir, "regional_trains.csv"), index=False
+            )
+            dataframe[dataframe["final_train_type"] == "Tram"].to_csv(os.path.join(self.output_dir, "trams.csv"), index=False)
+        if self.plot:
+            self.logger.info("Plot avg distance per stop")
+            self.visualize_distance_distribution(dataframe)
+        return dataframe
+
+    def transform_df_rowwise(self, dataframe):
+        """Reference implementation of transform_df that classifies row by row, without writing any files."""
         dataframe["line_category"] = dataframe["line"].apply(self.categorize_line)
         self.determine_line_prefix(dataframe)
-        dataframe["departure_time"] = dataframe["ID_Timestamp"].apply(
-            self.parse_departure_time
-        )
+        dataframe["departure_time"] = parse_id_timestamps(dataframe["ID_Timestamp"])
 
         # Drop rows with missing coordinates and sort by necessary columns
         dataframe = dataframe.dropna(subset=["long", "lat"])
@@ -126,18 +213,6 @@ class TrainTypeClassifier(Preprocessor):
         dataframe["final_train_type"] = dataframe.apply(
             self.final_classification, axis=1
         )
-        # Save grouped data for inspection
-        dataframe.to_csv("DBtrainrides_final_train_type.csv", index=False)
-        self.logger.info("Split grouped data and save it")
-        df_regional_train = dataframe[
-            dataframe["final_train_type"] == "Regional Train"
-        ].copy()
-        df_tram = dataframe[dataframe["final_train_type"] == "Tram"].copy()
-        df_regional_train.to_csv("./regional_trains.csv", index=False)
-        df_tram.to_csv("./trams.csv", index=False)
-        # The plot already exists in this repository in directory plots so only execute this when necessary
-        self.logger.info("Plot avg distance per stop")
-        self.visualize_distance_distribution(dataframe)
         return dataframe
 
     def visualize_distance_distribution(self, df):
@@ -150,5 +225,5 @@ class TrainTypeClassifier(Preprocessor):
         plt.xlabel("Average Distance Between Stops (km)")
         plt.ylabel("Number of Journeys")
         plt.title("Distribution of Average Distances Between Stops")
-        plt.savefig("./plots/distribution_avg_distance.png")
+        plt.savefig(os.path.join(self.output_dir, "plots", "distribution_avg_distance.png"))
         plt.clf()
@@ -0,0 +1,32 @@
+import argparse
+import os
+
+from utils.serving import make_server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local prediction server for a delay model saved with joblib.dump")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", help="Serve on this Unix socket instead of TCP")
+    parser.add_argument("--schedules",
+                        help="Preprocessed journeys (CSV or Parquet output of main.py) to enable POST /predict_journey")
+    parser.add_argument("--max-batch-rows", type=int, default=1024)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="Time the first request of a batch waits for further requests")
+    args = parser.parse_args()
+
+    if args.unix_socket and os.path.exists(args.unix_socket):
+        os.remove(args.unix_socket)
+    server = make_server(
+        args.model, args.host, args.port, args.unix_socket, args.max_batch_rows, args.max_wait_ms, args.schedules
+    )
+    print(f"Serving {args.model} on {args.unix_socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket:
+            os.remove(args.unix_socket)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+HOURS = 24
+
+
+class LookupTableBaseline:
+    """Predicts the mean delay of the station of a stop, falling back to its city, its line and the global mean.
+
+    The sums and counts of the delays are kept in dense arrays, one row per
+    compact integer ID of a key (e.g. an IBNR) and, with hour_column, one
+    column per hour of the day plus a last column for all hours. A stop gets
+    the mean of the first level in `levels` whose key was seen at least
+    min_count times, at its hour before all hours. partial_fit adds new data
+    to the sums and counts, so the model can be updated without the old data.
+
+    The model has fit/predict and feature_names_in_ like a scikit-learn
+    regressor, so it can be saved with joblib.dump and served with serve.py.
+    The levels have to be columns of the input, e.g. the output of
+    `main.py --columns ...,IBNR,city,line,arrival_plan,arrival_delay_m`.
+    """
+
+    def __init__(self, levels=("IBNR", "city", "line"), hour_column=None, min_count=1):
+        self.levels = list(levels)
+        self.hour_column = hour_column
+        self.min_count = min_count
+        self.feature_names_in_ = np.array(self.levels + ([hour_column] if hour_column else []), dtype=object)
+        self.reset()
+
+    def reset(self):
+        n_columns = HOURS + 1 if self.hour_column else 1
+        self.keys = {level: pd.Index([]) for level in self.levels}
+        self.sums = {level: np.zeros((0, n_columns)) for level in self.levels}
+        self.counts = {level: np.zeros((0, n_columns), dtype=np.int64) for level in self.levels}
+        self.total_sum = 0.0
+        self.total_count = 0
+
+    def ids(self, level, values):
+        """Compact IDs of the values of a level, -1 for keys that were not seen."""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Every category is looked up once, missing values have the code -1
+            category_ids = np.append(self.keys[level].get_indexer(values.cat.categories), -1)
+            return category_ids[values.cat.codes.to_numpy()]
+        return self.keys[level].get_indexer(values)
+
+    def hours(self, X):
+        if not self.hour_column:
+            return None
+        times = X[self.hour_column]
+        if not pd.api.types.is_datetime64_any_dtype(times):
+            times = pd.to_datetime(times)
+        # Stops without a time only use the column of all hours
+        return times.dt.hour.fillna(HOURS).to_numpy(dtype=np.int64)
+
+    def add_keys(self, level, values):
+        new_keys = pd.Index(np.asarray(values.dropna().unique())).difference(self.keys[level])
+        if len(new_keys) == 0:
+            return
+        self.keys[level] = new_keys if len(self.keys[level]) == 0 else self.keys[level].append(new_keys)
+        n_columns = self.sums[level].shape[1]
+        self.sums[level] = np.vstack([self.sums[level], np.zeros((len(new_keys), n_columns))])
+        self.counts[level] = np.vstack([self.counts[level], np.zeros((len(new_keys), n_columns), dtype=np.int64)])
+
+    def accumulate(self, level, ids, columns, y):
+        n_ids, n_columns = self.sums[level].shape
+        cells = ids * n_columns + columns
+        self.sums[level] += np.bincount(cells, y, minlength=n_ids * n_columns).reshape(n_ids, n_columns)
+        self.counts[level] += np.bincount(cells, minlength=n_ids * n_columns).reshape(n_ids, n_columns)
+
+    def partial_fit(self, X, y):
+        y = np.asarray(y, dtype="float64")
+        known = ~np.isnan(y)
+        X, y = X[known], y[known]
+        hours = self.hours(X)
+        self.total_sum += y.sum()
+        self.total_count += len(y)
+
+        for level in self.levels:
+            self.add_keys(level, X[level])
+            ids = self.ids(level, X[level])
+            present = ids >= 0
+            # The last column holds all hours
+            self.accumulate(level, ids[present], self.sums[level].shape[1] - 1, y[present])
+            if hours is not None:
+                timed = present & (hours < HOURS)
+                self.accumulate(level, ids[timed], hours[timed], y[timed])
+        return self
+
+    def fit(self, X, y):
+        self.reset()
+        return self.partial_fit(X, y)
+
+    @property
+    def global_mean(self):
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+    def predict(self, X):
+        predictions = np.full(len(X), self.global_mean)
+        hours = self.hours(X)
+        # From the least to the most specific lookup, so the most specific one that is available wins
+        for level in reversed(self.levels):
+            if len(self.keys[level]) == 0:
+                continue
+            ids = self.ids(level, X[level])
+            known = ids >= 0
+            counts, sums = self.counts[level], self.sums[level]
+            columns = [np.full(len(X), counts.shape[1] - 1)]
+            if hours is not None:
+                columns.append(hours)
+            for column in columns:
+                count = np.where(known, counts[ids, column], 0)
+                available = count >= self.min_count
+                predictions[available] = sums[ids[available], column[available]] / count[available]
+        return predictions
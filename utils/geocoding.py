@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+
+HERE_GEOCODE_URL = "https://geocode.search.hereapi.com/v1/geocode"
+# Responses worth another attempt, every other status is final
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger("Geocoding")
+
+
+class GeocodingCache:
+    """Persistent SQLite cache of geocoded station names.
+
+    Names without a result are stored with NULL coordinates, so they are not
+    requested again in later runs.
+    """
+
+    def __init__(self, path="geocoding_cache.sqlite"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS coordinates (name TEXT PRIMARY KEY, lat REAL, long REAL)"
+        )
+        self.connection.commit()
+
+    def get_many(self, names, batch_size=500):
+        """Returns {name: (lat, long)} for all cached names, coordinates are None for negative results."""
+        names = list(names)
+        found = {}
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"SELECT name, lat, long FROM coordinates WHERE name IN ({placeholders})", batch
+            )
+            for name, lat, long in rows:
+                found[name] = (lat, long)
+        return found
+
+    def put_many(self, results):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO coordinates (name, lat, long) VALUES (?, ?, ?)",
+            [(name, lat, long) for name, (lat, long) in results.items()],
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class RateLimiter:
+    """Spaces the start of requests to at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.lock = None
+
+    async def wait(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class HereGeocoder:
+    """Geocodes unique station names with the HERE API behind a persistent cache.
+
+    Cache misses are requested concurrently (at most `max_concurrency` at a
+    time, at most `requests_per_second`), failed requests are retried with an
+    exponential backoff. `url` can point to a local stand-in server.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        cache,
+        url=HERE_GEOCODE_URL,
+        max_concurrency=8,
+        requests_per_second=5,
+        max_retries=3,
+        backoff=0.5,
+        timeout=10,
+    ):
+        self.api_key = api_key
+        self.cache = cache
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def geocode_all(self, names):
+        """Returns {name: (lat, long)} for all names, coordinates are None if the name could not be resolved."""
+        names = list(dict.fromkeys(names))
+        results = self.cache.get_many(names)
+        misses = [name for name in names if name not in results]
+        if not misses:
+            return results
+
+        if self.api_key is None and self.url == HERE_GEOCODE_URL:
+            logger.warning(f"HERE_API_KEY is not set, {len(misses)} station names are not geocoded")
+            results.update({name: (None, None) for name in misses})
+            return results
+
+        logger.info(f"Geocode {len(misses)} station names missing in the cache")
+        fetched = asyncio.run(self.fetch_all(misses))
+        # Only definitive answers are cached, failed requests are tried again in the next run
+        self.cache.put_many({name: coordinates for name, coordinates in fetched.items() if coordinates is not None})
+        results.update({name: coordinates or (None, None) for name, coordinates in fetched.items()})
+        return results
+
+    async def fetch_all(self, names):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = RateLimiter(self.requests_per_second)
+        with ThreadPoolExecutor(self.max_concurrency) as pool, requests.Session() as session:
+            tasks = [self.fetch(name, session, pool, semaphore, limiter) for name in names]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        # An unexpected error of one name must not discard the results of the others
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Geocoding {name} failed: {result!r}")
+        return {name: None if isinstance(result, Exception) else result for name, result in zip(names, results)}
+
+    @staticmethod
+    def parse(body):
+        items = body.get("items")
+        if items:
+            location = items[0]["position"]
+            return float(location["lat"]), float(location["lng"])
+        return None, None
+
+    async def fetch(self, name, session, pool, semaphore, limiter):
+        """Returns (lat, long), (None, None) if there is no result and None if the request failed."""
+        params = {"q": name}
+        if self.api_key is not None:
+            params["apiKey"] = self.api_key
+        request = partial(session.get, self.url, params=params, timeout=self.timeout)
+
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await limiter.wait()
+                try:
+                    response = await loop.run_in_executor(pool, request)
+                except requests.RequestException as error:
+                    logger.warning(f"Request for {name} failed: {error}")
+                else:
+                    if response.status_code == 200:
+                        try:
+                            return self.parse(response.json())
+                        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as error:
+                            # A malformed body is handled like a failed request
+                            logger.warning(f"Response for {name} could not be parsed: {error!r}")
+                    elif response.status_code not in RETRY_STATUS_CODES:
+                        logger.warning(f"Request for {name} returned status {response.status_code}")
+                        return None
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+        return None
@@ -0,0 +1,190 @@
+"""Metrics of the preprocessing stages.
+
+Every transform/transform_df call of a Preprocessor is measured (see
+preprocessors/preprocessor.py). The metrics are written to the sink set with
+configure, or with the environment variables PREPROCESSOR_METRICS (a path
+ending with .prom for the Prometheus text format, JSON lines otherwise) and
+PREPROCESSOR_PROFILE_DIR (one cProfile dump per stage call).
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+PROMETHEUS_METRICS = {
+    "wall_seconds": "Wall time of the last call of the stage",
+    "cpu_seconds": "CPU time of this process during the last call of the stage",
+    "peak_rss_delta_bytes": "Peak resident set size during the last call of the stage above the size before it",
+    "rows_in": "Rows of the input of the last call of the stage",
+    "rows_out": "Rows of the output of the last call of the stage",
+    "bytes_written": "Bytes written by the process during the last call of the stage",
+}
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def written_bytes():
+    """Bytes written by this process so far, including writes that were only cached."""
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class PeakMemory:
+    """Samples the resident set size in a background thread while the block runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = self.peak = 0
+        self.running = False
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def increase(self):
+        return self.peak - self.start
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, record):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+
+class PrometheusSink:
+    """Keeps the last record of every stage in a Prometheus text file, e.g. for the textfile collector."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+
+    def emit(self, record):
+        self.records[(record["stage"], record["method"])] = record
+        lines = []
+        for metric, description in PROMETHEUS_METRICS.items():
+            lines.append(f"# HELP preprocessor_{metric} {description}")
+            lines.append(f"# TYPE preprocessor_{metric} gauge")
+            for (stage, method), stage_record in self.records.items():
+                value = stage_record[metric]
+                if value is not None:
+                    lines.append(f'preprocessor_{metric}{{stage="{stage}",method="{method}"}} {value}')
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+class Instrumentation:
+    def __init__(self, sink=None, profile_dir=None):
+        self.sink = sink
+        self.profile_dir = profile_dir
+        self.local = threading.local()
+
+
+def sink_for(path):
+    if path is None:
+        return None
+    return PrometheusSink(path) if path.endswith(".prom") else JsonLinesSink(path)
+
+
+instrumentation = Instrumentation(
+    sink_for(os.environ.get("PREPROCESSOR_METRICS")), os.environ.get("PREPROCESSOR_PROFILE_DIR")
+)
+
+
+def configure(metrics_path=None, profile_dir=None):
+    """Sets where the metrics (and optionally the cProfile dumps) of the stages are written."""
+    instrumentation.sink = sink_for(metrics_path)
+    instrumentation.profile_dir = profile_dir
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def row_count(value):
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+
+@contextlib.contextmanager
+def measure(stage, method, df=None, logger=None):
+    """Measures the block and emits one record, the caller sets record["rows_out"]."""
+    # Calls within a measured call (e.g. transform_df calling transform) are part of the outer record
+    if getattr(instrumentation.local, "active", False):
+        yield {}
+        return
+    instrumentation.local.active = True
+    record = {"stage": stage, "method": method, "rows_in": row_count(df), "rows_out": None}
+    profiler = cProfile.Profile() if instrumentation.profile_dir else None
+    wall, cpu, written = time.perf_counter(), time.process_time(), written_bytes()
+    try:
+        with PeakMemory() as memory:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield record
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        instrumentation.local.active = False
+
+    record.update(
+        wall_seconds=time.perf_counter() - wall,
+        cpu_seconds=time.process_time() - cpu,
+        peak_rss_delta_bytes=memory.increase,
+        bytes_written=written_bytes() - written,
+        timestamp=time.time(),
+    )
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(instrumentation.profile_dir, f"{stage}.{method}.prof"))
+    if instrumentation.sink is not None:
+        instrumentation.sink.emit(record)
+    if logger is not None:
+        logger.info(
+            f"{method} took {record['wall_seconds']:.2f} s ({record['cpu_seconds']:.2f} s CPU), "
+            f"{record['rows_in']} -> {record['rows_out']} rows, +{memory.increase / 2**20:.0f} MB peak RSS"
+        )
+
+
+def instrumented(method):
+    """Wraps a transform method of a Preprocessor so every call is measured."""
+
+    @functools.wraps(method)
+    def wrapper(self, df, *args, **kwargs):
+        with measure(self.name, method.__name__, df, self.logger) as record:
+            result = method(self, df, *args, **kwargs)
+            record["rows_out"] = row_count(result)
+        return result
+
+    return wrapper
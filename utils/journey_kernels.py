@@ -0,0 +1,136 @@
+"""Segmented kernels over a frame sorted by journey.
+
+The journeys are described by an offset array: the rows of journey ``j`` are
+``offsets[j]:offsets[j + 1]``. Every kernel walks all journeys in a single
+pass, which replaces one groupby(...).apply call (and its Python overhead)
+per journey. The arithmetic follows the pandas/numpy operations it replaces
+step by step, so the results are identical.
+"""
+import numba
+import numpy as np
+
+NAT = np.iinfo(np.int64).min
+
+
+def journey_offsets(*keys):
+    """Returns the offsets of the runs of equal keys in arrays sorted by journey."""
+    n_rows = len(keys[0])
+    starts = np.zeros(n_rows, dtype=bool)
+    if n_rows > 0:
+        starts[0] = True
+        for key in keys:
+            key = np.asarray(key)
+            starts[1:] |= key[1:] != key[:-1]
+    return np.append(np.flatnonzero(starts), n_rows).astype(np.int64)
+
+
+@numba.njit(cache=True)
+def delay_features(arrival_delays, departure_delays, offsets):
+    """Previous delays, weighted average of the previous delays, cumulative delay and delay gain."""
+    n_rows = len(arrival_delays)
+    prev_arrival = np.empty(n_rows)
+    prev_departure = np.empty(n_rows)
+    weighted_avg_prev = np.empty(n_rows)
+    cumulative = np.empty(n_rows)
+    gain = np.empty(n_rows)
+
+    for journey in range(len(offsets) - 1):
+        start, end = offsets[journey], offsets[journey + 1]
+        numerator = 0.0
+        denominator = 0
+        accum = 0.0
+        compensation = 0.0
+        for i in range(start, end):
+            # shift(1).fillna(0)
+            if i == start:
+                prev_arrival[i] = 0.0
+                prev_departure[i] = 0.0
+            else:
+                prev_arrival[i] = 0.0 if np.isnan(arrival_delays[i - 1]) else arrival_delays[i - 1]
+                prev_departure[i] = 0.0 if np.isnan(departure_delays[i - 1]) else departure_delays[i - 1]
+
+            # Weighted average of the delays before the current stop
+            weighted_avg_prev[i] = 0.0 if i == start else numerator / denominator
+            delay = 0.0 if np.isnan(arrival_delays[i]) else arrival_delays[i]
+            weight = i - start + 1
+            numerator += delay * weight
+            denominator += weight
+
+            # cumsum skipping NaN with the same Kahan summation as pandas
+            if np.isnan(arrival_delays[i]):
+                cumulative[i] = np.nan
+            else:
+                y = arrival_delays[i] - compensation
+                t = accum + y
+                compensation = t - accum - y
+                accum = t
+                cumulative[i] = t
+
+            # diff().fillna(0)
+            if i == start:
+                gain[i] = 0.0
+            else:
+                difference = cumulative[i] - cumulative[i - 1]
+                gain[i] = 0.0 if np.isnan(difference) else difference
+
+    return prev_arrival, prev_departure, weighted_avg_prev, cumulative, gain
+
+
+@numba.njit(cache=True)
+def schedule_features(stop_numbers, departure_plans, arrival_plans, offsets):
+    """Maximal stop number, first departure, last arrival and next arrival per journey.
+
+    The planned times are int64 nanoseconds with NAT for missing values,
+    first/last skip missing values like groupby(...).transform("first"/"last").
+    """
+    n_rows = len(stop_numbers)
+    max_stop_numbers = np.empty_like(stop_numbers)
+    origin_departures = np.empty(n_rows, dtype=np.int64)
+    last_arrivals = np.empty(n_rows, dtype=np.int64)
+    next_arrivals = np.empty(n_rows, dtype=np.int64)
+
+    for journey in range(len(offsets) - 1):
+        start, end = offsets[journey], offsets[journey + 1]
+        max_stop_number = stop_numbers[start]
+        origin_departure = NAT
+        last_arrival = NAT
+        for i in range(start, end):
+            # Comparisons with NaN are False, so missing stop numbers are skipped
+            if stop_numbers[i] > max_stop_number or max_stop_number != max_stop_number:
+                max_stop_number = stop_numbers[i]
+            if origin_departure == NAT:
+                origin_departure = departure_plans[i]
+            if arrival_plans[i] != NAT:
+                last_arrival = arrival_plans[i]
+            next_arrivals[i] = arrival_plans[i + 1] if i + 1 < end else NAT
+        max_stop_numbers[start:end] = max_stop_number
+        origin_departures[start:end] = origin_departure
+        last_arrivals[start:end] = last_arrival
+
+    return max_stop_numbers, origin_departures, last_arrivals, next_arrivals
+
+
+@numba.njit(cache=True)
+def distance_features(segment_distances, offsets):
+    """Distance to the previous/next stop, from the origin and in total.
+
+    segment_distances[i] is the distance between row i - 1 and row i, its
+    value at the first stop of a journey is ignored.
+    """
+    n_rows = len(segment_distances)
+    to_prev = np.empty(n_rows)
+    from_origin = np.empty(n_rows)
+    total = np.empty(n_rows)
+    to_next = np.empty(n_rows)
+
+    for journey in range(len(offsets) - 1):
+        start, end = offsets[journey], offsets[journey + 1]
+        distance = 0.0
+        for i in range(start, end):
+            to_prev[i] = 0.0 if i == start else segment_distances[i]
+            distance += to_prev[i]
+            from_origin[i] = distance
+            to_next[i] = segment_distances[i + 1] if i + 1 < end else 0.0
+        total[start:end] = distance
+
+    return to_prev, from_origin, total, to_next
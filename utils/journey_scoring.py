@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from utils.journey_kernels import journey_offsets
+from utils.schema import FEATURE_DTYPES, apply_schema
+
+# Features that depend on the delays at the previous stops, all other features are known from the schedule
+DELAY_FEATURES = ["prev_arrival_delay_m", "prev_departure_delay_m", "weighted_avg_prev_delay"]
+
+
+class JourneyScorer:
+    """Predicts the arrival delay at all remaining stops of a journey with one model call.
+
+    The schedule features of every journey (stop, station, coordinates,
+    normalized planned times, progress) are taken once from a preprocessed
+    frame like the output of main.py and kept in journey order. For a request
+    only the delay features are computed, from the delays observed so far.
+    The delays at the stops that are not reached yet are not known, they are
+    assumed to stay at the last observed delay.
+    """
+
+    def __init__(self, model, schedules, columns=None):
+        self.model = model
+        self.columns = list(columns if columns is not None else getattr(model, "feature_names_in_", FEATURE_DTYPES))
+        keys = ["ID_Base", "ID_Timestamp", "stop_number"]
+        schedule_columns = keys + [column for column in self.columns if column not in DELAY_FEATURES + keys]
+        schedules = apply_schema(schedules[schedule_columns], FEATURE_DTYPES)
+        self.schedules = schedules.sort_values(keys).reset_index(drop=True)
+
+        offsets = journey_offsets(self.schedules["ID_Base"].values, self.schedules["ID_Timestamp"].values)
+        keys = zip(self.schedules["ID_Base"].values[offsets[:-1]], self.schedules["ID_Timestamp"].values[offsets[:-1]])
+        self.journeys = {key: (start, end) for key, start, end in zip(keys, offsets[:-1], offsets[1:])}
+
+    @staticmethod
+    def delay_features(arrival_delays, departure_delays, n_stops):
+        """Delay features of all stops of a journey, continuing the observed delays to n_stops stops."""
+        arrival = np.zeros(n_stops)
+        departure = np.zeros(n_stops)
+        observed = min(len(arrival_delays), n_stops)
+        arrival[:observed] = np.nan_to_num(np.asarray(arrival_delays, dtype="float64")[:observed])
+        departure[:observed] = np.nan_to_num(np.asarray(departure_delays, dtype="float64")[:observed])
+        if 0 < observed < n_stops:
+            arrival[observed:] = arrival[observed - 1]
+            departure[observed:] = departure[observed - 1]
+
+        # Same terms as LagInfoExtractor: shift(1).fillna(0) and the delays weighted by their position
+        weights = np.arange(1, n_stops + 1)
+        numerator = np.cumsum(arrival * weights)
+        denominator = np.cumsum(weights)
+        weighted_avg_prev = np.zeros(n_stops)
+        weighted_avg_prev[1:] = numerator[:-1] / denominator[:-1]
+        return pd.DataFrame({
+            "prev_arrival_delay_m": np.concatenate(([0.0], arrival[:-1])),
+            "prev_departure_delay_m": np.concatenate(([0.0], departure[:-1])),
+            "weighted_avg_prev_delay": weighted_avg_prev,
+        })
+
+    def features(self, id_base, id_timestamp, arrival_delays, departure_delays=None):
+        """Feature matrix of the stops after the observed ones.
+
+        The delays are observed at the stops 1 to len(arrival_delays), in
+        stop order and starting with the origin.
+        """
+        if (int(id_base), int(id_timestamp)) not in self.journeys:
+            raise KeyError(f"Unknown journey {id_base}-{id_timestamp}")
+        start, end = self.journeys[(int(id_base), int(id_timestamp))]
+        if departure_delays is None:
+            departure_delays = arrival_delays
+        schedule = self.schedules.iloc[start:end]
+        remaining = schedule[schedule["stop_number"] > len(arrival_delays)]
+
+        # The stop numbers are the positions within the journey, also of stops that are not in the schedule
+        n_stops = int(schedule["stop_number"].max())
+        delays = self.delay_features(arrival_delays, departure_delays, n_stops)
+        delays = delays.iloc[remaining["stop_number"].to_numpy() - 1].set_axis(remaining.index)
+        return pd.concat([remaining, delays], axis=1)[self.columns]
+
+    def score(self, id_base, id_timestamp, arrival_delays, departure_delays=None):
+        """Returns the stop numbers of the remaining stops with their predicted arrival delay."""
+        features = self.features(id_base, id_timestamp, arrival_delays, departure_delays)
+        predictions = self.model.predict(features) if len(features) else np.empty(0)
+        # The features are indexed by their rows in the schedules, which also hold the stop numbers if the model does not use them
+        stop_numbers = self.schedules["stop_number"].to_numpy()[features.index.to_numpy()]
+        return pd.DataFrame({"stop_number": stop_numbers, "arrival_delay_m": predictions})
@@ -0,0 +1,142 @@
+"""Online version of the per-journey features of the LagInfoExtractor.
+
+Every running journey keeps a few accumulators, so a new stop event updates
+all features in constant time. The arithmetic follows the batch kernels in
+utils/journey_kernels.py, replaying a journey stop by stop gives the values
+of LagInfoExtractor.transform_journeys (the distances up to the rounding of
+the trigonometric functions).
+"""
+import math
+
+import pandas as pd
+
+R = 6371  # Earth radius in kilometers
+NS_PER_SECOND = 1e9
+
+
+def _to_ns(value):
+    value = pd.Timestamp(value)
+    return None if pd.isna(value) else value.value
+
+
+def _divide(numerator, denominator):
+    # Float division with the results of numpy instead of a ZeroDivisionError
+    if denominator == 0:
+        return math.nan if numerator == 0 or math.isnan(numerator) else math.copysign(math.inf, numerator)
+    return numerator / denominator
+
+
+def _minutes(end_ns, start_ns):
+    if end_ns is None or start_ns is None:
+        return math.nan
+    return (end_ns - start_ns) / NS_PER_SECOND / 60
+
+
+class JourneyState:
+    """Accumulators of one journey, the schedule is known when the journey starts."""
+
+    __slots__ = (
+        "departure_time", "max_stop_number", "total_planned_time", "n_stops",
+        "prev_arrival_delay", "prev_departure_delay", "numerator", "denominator",
+        "cumulative", "compensation", "prev_cumulative",
+        "distance_from_origin", "prev_lat_rad", "prev_long_rad",
+    )
+
+    def __init__(self, departure_time, max_stop_number, last_arrival_plan):
+        self.departure_time = _to_ns(departure_time)
+        self.max_stop_number = max_stop_number
+        self.total_planned_time = _minutes(_to_ns(last_arrival_plan), self.departure_time)
+        self.n_stops = 0
+        self.prev_arrival_delay = 0.0
+        self.prev_departure_delay = 0.0
+        self.numerator = 0.0
+        self.denominator = 0
+        self.cumulative = 0.0
+        self.compensation = 0.0
+        self.prev_cumulative = math.nan
+        self.distance_from_origin = 0.0
+        self.prev_lat_rad = None
+        self.prev_long_rad = None
+
+
+class OnlineFeatureEngine:
+    """Keeps the state of all running journeys and computes their features per stop event.
+
+    A journey is started with its planned schedule (the highest stop number
+    and the last planned arrival), then its stops are passed to update in
+    stop order. Stops without coordinates update the delay features but get
+    no distance features, as they are dropped by the batch extractor.
+    """
+
+    def __init__(self):
+        self.journeys = {}
+
+    def __len__(self):
+        return len(self.journeys)
+
+    def start_journey(self, journey, departure_time, max_stop_number, last_arrival_plan):
+        self.journeys[journey] = JourneyState(departure_time, max_stop_number, last_arrival_plan)
+
+    def end_journey(self, journey):
+        self.journeys.pop(journey, None)
+
+    def update(self, journey, stop_number, arrival_plan, arrival_delay_m, departure_delay_m, lat, long):
+        state = self.journeys[journey]
+        first = state.n_stops == 0
+        state.n_stops += 1
+
+        features = {
+            "prev_arrival_delay_m": state.prev_arrival_delay,
+            "prev_departure_delay_m": state.prev_departure_delay,
+            "weighted_avg_prev_delay": 0.0 if first else state.numerator / state.denominator,
+        }
+        state.prev_arrival_delay = 0.0 if math.isnan(arrival_delay_m) else arrival_delay_m
+        state.prev_departure_delay = 0.0 if math.isnan(departure_delay_m) else departure_delay_m
+        state.numerator += state.prev_arrival_delay * state.n_stops
+        state.denominator += state.n_stops
+
+        # Kahan summation skipping NaN, like the cumsum of pandas
+        if math.isnan(arrival_delay_m):
+            cumulative = math.nan
+        else:
+            y = arrival_delay_m - state.compensation
+            t = state.cumulative + y
+            state.compensation = t - state.cumulative - y
+            state.cumulative = cumulative = t
+        gain = 0.0 if first else cumulative - state.prev_cumulative
+        state.prev_cumulative = cumulative
+        features["cumulative_delay"] = cumulative
+        features["delay_gain"] = 0.0 if math.isnan(gain) else gain
+
+        station_progress = _divide(stop_number, state.max_stop_number)
+        time_progress = _divide(_minutes(_to_ns(arrival_plan), state.departure_time), state.total_planned_time)
+        if time_progress == 0 or math.isnan(time_progress):
+            progress_ratio = 0.0
+        else:
+            progress_ratio = station_progress / time_progress
+            if math.isinf(progress_ratio) or math.isnan(progress_ratio):
+                progress_ratio = 0.0
+        features["station_progress"] = station_progress
+        features["time_progress"] = time_progress
+        features["progress_ratio"] = progress_ratio
+
+        if math.isnan(lat) or math.isnan(long):
+            features["distance_to_prev_stop"] = math.nan
+            features["distance_from_origin"] = math.nan
+            return features
+        lat_rad, long_rad = math.radians(lat), math.radians(long)
+        if state.prev_lat_rad is None:
+            distance = 0.0
+        else:
+            a = (
+                math.sin((lat_rad - state.prev_lat_rad) / 2.0) ** 2
+                + math.cos(state.prev_lat_rad)
+                * math.cos(lat_rad)
+                * math.sin((long_rad - state.prev_long_rad) / 2.0) ** 2
+            )
+            distance = R * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+        state.prev_lat_rad, state.prev_long_rad = lat_rad, long_rad
+        state.distance_from_origin += distance
+        features["distance_to_prev_stop"] = distance
+        features["distance_from_origin"] = state.distance_from_origin
+        return features
@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+
+def declared_columns(function):
+    """Returns the (reads, writes) of the Preprocessor of a stage function, or None if it may change the rows."""
+    owner = getattr(function, "__self__", None)
+    if owner is None or getattr(owner, "reads", None) is None or getattr(owner, "writes", None) is None:
+        return None
+    return set(owner.reads), set(owner.writes)
+
+
+class StageGraph:
+    """Runs the stages of the pipeline as a DAG of their column dependencies.
+
+    A stage whose Preprocessor declares the columns it reads and writes only
+    gets these columns, as a frame that shares the buffers of the pipeline
+    frame, and its written columns are merged back afterwards. Such stages
+    run concurrently (in threads) with every other stage they do not share a
+    written column with. All other stages may change the rows of the frame, so
+    they wait for every stage before them and every stage after them waits
+    for them. The result is the same as running the stages one after another.
+    """
+
+    def __init__(self, stages, max_workers=4):
+        self.stages = stages
+        self.max_workers = max_workers
+        self.columns = [declared_columns(function) for _, function, _ in stages]
+        self.dependencies = [
+            [before for before in range(index) if self.conflict(before, index)] for index in range(len(stages))
+        ]
+        self.seconds = [None] * len(stages)
+
+    def conflict(self, before, after):
+        if self.columns[before] is None or self.columns[after] is None:
+            return True
+        reads_before, writes_before = self.columns[before]
+        reads_after, writes_after = self.columns[after]
+        return bool(writes_before & (reads_after | writes_after) or reads_before & writes_after)
+
+    def timed(self, index, df):
+        start = time.perf_counter()
+        result = self.stages[index][1](df)
+        self.seconds[index] = time.perf_counter() - start
+        return result
+
+    def run(self, df, on_output=None):
+        """Runs all stages on df. on_output(index, df) is called with the output of every row changing stage."""
+        done, running = set(), {}
+        # Columns added by the column stages since the last row changing stage, to restore the serial column order
+        added = {}
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while len(done) < len(self.stages):
+                for index in range(len(self.stages)):
+                    if index in done or index in running.values() or len(running) >= self.max_workers:
+                        continue
+                    if not all(dependency in done for dependency in self.dependencies[index]):
+                        continue
+                    if self.columns[index] is None:
+                        df = self.restore_column_order(df, added)
+                        added = {}
+                        running[pool.submit(self.timed, index, df)] = index
+                    else:
+                        reads, _ = self.columns[index]
+                        inputs = pd.DataFrame({column: df[column] for column in sorted(reads)}, index=df.index, copy=False)
+                        running[pool.submit(self.timed, index, inputs)] = index
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    result = future.result()
+                    if self.columns[index] is None:
+                        df = result
+                        if on_output is not None:
+                            on_output(index, df)
+                    else:
+                        writes = self.columns[index][1]
+                        added[index] = [column for column in result.columns if column in writes and column not in df]
+                        df = self.merge(index, df, result)
+                    done.add(index)
+        return self.restore_column_order(df, added)
+
+    def merge(self, index, df, result):
+        name = self.stages[index][0]
+        if not result.index.equals(df.index):
+            raise ValueError(f"{name} changed the rows of the frame, so it must not declare its columns")
+        missing = self.columns[index][1] - set(result.columns)
+        if missing:
+            raise ValueError(f"{name} did not write the declared columns {', '.join(sorted(missing))}")
+        for column in self.columns[index][1]:
+            df[column] = result[column]
+        return df
+
+    @staticmethod
+    def restore_column_order(df, added):
+        """Orders the new columns as if the column stages had finished in the order of the stages."""
+        new_columns = [column for index in sorted(added) for column in added[index]]
+        columns = [column for column in df.columns if column not in new_columns] + new_columns
+        if columns == list(df.columns):
+            return df
+        return df[columns]
+
+    def critical_path(self):
+        """Returns the (name, seconds) of the chain of dependent stages with the longest total time."""
+        finish, previous = [], []
+        for index, dependencies in enumerate(self.dependencies):
+            before = max(dependencies, key=lambda dependency: finish[dependency], default=None)
+            finish.append((finish[before] if before is not None else 0.0) + (self.seconds[index] or 0.0))
+            previous.append(before)
+        index = max(range(len(finish)), key=finish.__getitem__, default=None)
+        path = []
+        while index is not None:
+            path.append((self.stages[index][0], self.seconds[index] or 0.0))
+            index = previous[index]
+        return path[::-1]
+
+    def report(self):
+        path = self.critical_path()
+        total = sum(seconds for seconds in self.seconds if seconds is not None)
+        chain = " -> ".join(f"{name} {seconds:.2f} s" for name, seconds in path)
+        return (
+            f"Critical path: {chain} ({sum(seconds for _, seconds in path):.2f} s "
+            f"of {total:.2f} s in all stages)"
+        )
@@ -0,0 +1,107 @@
+import argparse
+
+import pandas as pd
+
+# Columns of DBtrainrides.csv the pipeline reads, with compact dtypes. The
+# station, state, category and *_delay_check columns are never used.
+RAW_DTYPES = {
+    "ID": "string[pyarrow]",
+    "line": "category",
+    "path": "string[pyarrow]",
+    "eva_nr": "Int64",
+    "city": "category",
+    "zip": "category",
+    "long": "float64",
+    "lat": "float64",
+    # Delays are whole minutes, which float32 represents exactly
+    "arrival_delay_m": "float32",
+    "departure_delay_m": "float32",
+    "info": "category",
+}
+DATE_COLUMNS = ["arrival_plan", "departure_plan", "arrival_change", "departure_change"]
+
+# Dtypes of the stop rows created by the PathExploder, which the later stages keep. The
+# parts of the ID are numeric and coded as integers like in FEATURE_DTYPES.
+STOP_DTYPES = {
+    "ID_Base": "int64",
+    "ID_Timestamp": "int64",
+    "stop_number": "int64",
+    "line": "category",
+    "starting_station_IBNR": "Int64",
+    "city": "category",
+    "zip": "category",
+    "last_station": "category",
+    "IBNR": "Int64",
+    "long": "float64",
+    "lat": "float64",
+    "arrival_plan": "datetime64[ns]",
+    "departure_plan": "datetime64[ns]",
+    "arrival_change": "datetime64[ns]",
+    "departure_change": "datetime64[ns]",
+    "arrival_delay_m": "float32",
+    "departure_delay_m": "float32",
+    "info": "category",
+    "canceled": "bool",
+}
+
+# Dtypes of the model features, as the training notebooks read them from the output of main.py
+FEATURE_DTYPES = {
+    "ID_Base": "int64",
+    "ID_Timestamp": "int64",
+    "stop_number": "int64",
+    "IBNR": "float64",
+    "long": "float64",
+    "lat": "float64",
+    "prev_arrival_delay_m": "float64",
+    "prev_departure_delay_m": "float64",
+    "weighted_avg_prev_delay": "float64",
+    "max_station_number": "int64",
+    "station_progress": "float64",
+    "info_label_encoded": "int64",
+    "arrival_normalized": "float64",
+    "departure_normalized": "float64",
+}
+
+
+def read_trainrides(path, columns=None, **kwargs):
+    """Reads DBtrainrides.csv (or a part of it) with the declared schema, optionally only the given columns."""
+    if columns is None:
+        columns = list(RAW_DTYPES) + DATE_COLUMNS
+    return pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={column: dtype for column, dtype in RAW_DTYPES.items() if column in columns},
+        parse_dates=[column for column in DATE_COLUMNS if column in columns],
+        **kwargs,
+    )
+
+
+def apply_schema(df, dtypes=STOP_DTYPES):
+    """Casts the present columns that do not have their declared dtype yet."""
+    casts = {
+        column: dtype
+        for column, dtype in dtypes.items()
+        if column in df.columns and df[column].dtype != dtype
+    }
+    return df.astype(casts) if casts else df
+
+
+def memory_report(path, nrows=None):
+    """Memory per column with the inferred dtypes of pd.read_csv and with the declared schema."""
+    inferred = pd.read_csv(path, nrows=nrows).memory_usage(index=False, deep=True)
+    compact = read_trainrides(path, nrows=nrows).memory_usage(index=False, deep=True)
+    report = pd.DataFrame({"inferred_bytes": inferred, "schema_bytes": compact}).fillna(0).astype("int64")
+    report["saved_bytes"] = report["inferred_bytes"] - report["schema_bytes"]
+    report["saved_percent"] = (100 * report["saved_bytes"] / report["inferred_bytes"]).round(1)
+    report = report.sort_values("saved_bytes", ascending=False)
+    total = report[["inferred_bytes", "schema_bytes", "saved_bytes"]].sum()
+    report.loc["total"] = [*total, round(100 * total["saved_bytes"] / total["inferred_bytes"], 1)]
+    return report.astype({"inferred_bytes": "int64", "schema_bytes": "int64", "saved_bytes": "int64"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory saved per column by the declared schema")
+    parser.add_argument("path", nargs="?", default="DBtrainrides.csv")
+    parser.add_argument("--rows", type=int, default=None, help="Only read the first rows of the file")
+    args = parser.parse_args()
+    print(memory_report(args.path, args.rows).to_string())
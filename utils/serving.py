@@ -0,0 +1,236 @@
+import collections
+import json
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from utils.journey_scoring import JourneyScorer
+from utils.schema import FEATURE_DTYPES, apply_schema
+
+
+def feature_frame(rows, columns):
+    """Builds the feature matrix of the model from JSON rows with the dtypes of the training data."""
+    df = pd.DataFrame.from_records(rows)
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing features: {', '.join(missing)}")
+    return apply_schema(df[columns], FEATURE_DTYPES)
+
+
+class LatencyStats:
+    """Request latencies of a sliding window and counters since the start of the server."""
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_batch(self, n_rows):
+        with self.lock:
+            self.batches += 1
+            self.rows += n_rows
+
+    def record_request(self, latency, failed=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += failed
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            uptime = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+                "rows_per_second": self.rows / uptime,
+                "uptime_s": uptime,
+            }
+
+
+class MicroBatcher:
+    """Collects the rows of concurrent requests and predicts them with one vectorized call.
+
+    A batch is closed when it has max_batch_rows rows or when its first
+    request has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, model, columns, max_batch_rows=1024, max_wait_ms=2.0, stats=None):
+        self.model = model
+        self.columns = columns
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or LatencyStats()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, rows):
+        """Returns a future with the predictions of the rows."""
+        future = Future()
+        self.requests.put((rows, future))
+        return future
+
+    def predict(self, rows, timeout=30):
+        return self.submit(rows).result(timeout)
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        n_rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch_rows:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_rows += len(request[0])
+        return batch
+
+    def predict_rows(self, rows):
+        predictions = np.asarray(self.model.predict(feature_frame(rows, self.columns)), dtype="float64")
+        self.stats.record_batch(len(predictions))
+        return predictions
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                predictions = self.predict_rows([row for rows, _ in batch for row in rows])
+            except Exception:
+                # Predict the requests one by one so only the invalid requests fail
+                for rows, future in batch:
+                    try:
+                        future.set_result(self.predict_rows(rows))
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+
+            start = 0
+            for rows, future in batch:
+                future.set_result(predictions[start:start + len(rows)])
+                start += len(rows)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """POST /predict with {"rows": [{feature: value, ...}, ...]}, GET /metrics and GET /health.
+
+    With a JourneyScorer, POST /predict_journey with {"ID_Base": ..., "ID_Timestamp": ...,
+    "arrival_delays": [...], "departure_delays": [...]} predicts all remaining stops of a journey.
+    """
+
+    batcher = None
+    scorer = None
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.batcher.stats.snapshot())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok", "features": self.batcher.columns})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/predict":
+            respond = self.predict
+        elif self.path == "/predict_journey" and self.scorer is not None:
+            respond = self.predict_journey
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            result = respond(body)
+        except Exception as error:
+            self.batcher.stats.record_request(time.perf_counter() - start, failed=True)
+            self.send_json(400, {"error": str(error)})
+            return
+        self.batcher.stats.record_request(time.perf_counter() - start)
+        self.send_json(200, result)
+
+    def predict(self, body):
+        rows = body["rows"] if isinstance(body, dict) else body
+        predictions = self.batcher.predict(rows) if rows else []
+        return {"predictions": [float(value) for value in predictions]}
+
+    def predict_journey(self, body):
+        # One model call for all remaining stops, so the journey does not go through the micro-batcher
+        scores = self.scorer.score(
+            body["ID_Base"], body["ID_Timestamp"], body["arrival_delays"], body.get("departure_delays")
+        )
+        self.batcher.stats.record_batch(len(scores))
+        return {
+            "stop_number": scores["stop_number"].tolist(),
+            "arrival_delay_m": scores["arrival_delay_m"].astype(float).tolist(),
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PredictionHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 resets connections of concurrent clients
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        # The handler expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def load_model(path):
+    """Loads a model saved with joblib.dump and returns it with the names of its features."""
+    model = joblib.load(path)
+    columns = getattr(model, "feature_names_in_", None)
+    columns = list(columns) if columns is not None else list(FEATURE_DTYPES)
+    return model, columns
+
+
+def make_server(model_path, host="127.0.0.1", port=8000, unix_socket=None, max_batch_rows=1024, max_wait_ms=2.0,
+                schedules_path=None):
+    model, columns = load_model(model_path)
+    attributes = {"batcher": MicroBatcher(model, columns, max_batch_rows, max_wait_ms)}
+    if schedules_path is not None:
+        # The planned stops of every journey, e.g. the output of main.py
+        if schedules_path.endswith(".parquet"):
+            schedules = pd.read_parquet(schedules_path)
+        else:
+            schedules = pd.read_csv(schedules_path)
+        attributes["scorer"] = JourneyScorer(model, schedules, columns)
+    handler = type("Handler", (PredictionHandler,), attributes)
+    if unix_socket is not None:
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return PredictionHTTPServer((host, port), handler)
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def _shared_dir():
+    # /dev/shm is memory backed on Linux, everywhere else fall back to the temp directory
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _write_arrow(df, directory):
+    path = os.path.join(directory, f"shard-{uuid.uuid4().hex}.arrow")
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return path
+
+
+def _read_arrow(path):
+    with pa.memory_map(path, "r") as source:
+        df = pa.ipc.open_file(source).read_all().to_pandas()
+    os.remove(path)
+    return df
+
+
+def _run_shard(func, path, directory):
+    return _write_arrow(func(_read_arrow(path)), directory)
+
+
+class JourneyShardExecutor:
+    """Runs per-journey work on hash partitions of a dataframe in a process pool.
+
+    Rows are partitioned by ID_Base, so every journey is handled by exactly one
+    worker. Shards and results are exchanged as Arrow IPC files in shared
+    memory instead of pickled dataframes. The results are merged back by the
+    position of the rows in the input, which reproduces the serial output as
+    long as the applied function keeps (a subset of) the rows of the input in
+    input order, like groupby(...).apply on an input sorted by journey does.
+    """
+
+    def __init__(self, n_workers=None, n_shards=None, key="ID_Base"):
+        self.n_workers = n_workers or os.cpu_count()
+        self.n_shards = n_shards or self.n_workers
+        self.key = key
+
+    def map(self, func, df):
+        if self.n_shards == 1 or len(df) == 0:
+            return func(df)
+
+        original_index = df.index
+        df = df.reset_index(drop=True)
+        shard_ids = pd.util.hash_pandas_object(df[self.key], index=False).to_numpy() % self.n_shards
+
+        directory = _shared_dir()
+        with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+            futures = []
+            for shard in range(self.n_shards):
+                positions = np.flatnonzero(shard_ids == shard)
+                if len(positions) > 0:
+                    path = _write_arrow(df.iloc[positions], directory)
+                    futures.append(pool.submit(_run_shard, func, path, directory))
+            del df
+            results = [_read_arrow(future.result()) for future in futures]
+
+        merged = pd.concat(results).sort_index(kind="stable")
+        merged.index = original_index[merged.index]
+        return merged
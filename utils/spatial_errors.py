@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# Approximate geographic boundaries of Germany
+GERMANY_BOUNDS = {
+    "min_lat": 47.0, "max_lat": 55.0,
+    "min_lon": 5.0, "max_lon": 15.0,
+}
+
+
+def create_grid(bounds, cell_size):
+    lat_edges = np.arange(bounds["min_lat"], bounds["max_lat"], cell_size)
+    lon_edges = np.arange(bounds["min_lon"], bounds["max_lon"], cell_size)
+    return lat_edges, lon_edges
+
+
+def bin_index(values, edges, cell_size):
+    """Index of the right closed bin (edges[i], edges[i + 1]] of every value like pd.cut, -1 outside of the edges."""
+    n_bins = len(edges) - 1
+    missing = np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        index = np.clip(np.ceil((values - edges[0]) / cell_size) - 1, -1, n_bins)
+    index = np.where(missing, -1, index).astype(np.int64)
+    # The division can be off by one next to an edge, so the value is compared with the edges of its bin
+    padded = np.concatenate([[-np.inf], edges, [np.inf]])
+    index -= values <= padded[index + 1]
+    index += values > padded[np.minimum(index + 2, n_bins + 2)]
+    index[missing | (index < 0) | (index >= n_bins)] = -1
+    return index
+
+
+class ErrorGrid:
+    """Count, sum of squared errors and sum of absolute errors of the predictions in every grid cell.
+
+    The arrays have one row per latitude bin and one column per longitude bin.
+    """
+
+    def __init__(self, lat_edges, lon_edges, count, squared_errors, absolute_errors):
+        self.lat_edges = lat_edges
+        self.lon_edges = lon_edges
+        self.count = count
+        self.squared_errors = squared_errors
+        self.absolute_errors = absolute_errors
+
+    def mean(self, sums):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, sums / self.count, np.nan)
+
+    @property
+    def mse(self):
+        return self.mean(self.squared_errors)
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.mse)
+
+    @property
+    def mae(self):
+        return self.mean(self.absolute_errors)
+
+    def to_frame(self):
+        """One row per non-empty cell with the cell center, e.g. for a scatter plot of the errors."""
+        lat_index, lon_index = np.nonzero(self.count)
+        return pd.DataFrame({
+            "lat_center": (self.lat_edges[lat_index] + self.lat_edges[lat_index + 1]) / 2,
+            "lon_center": (self.lon_edges[lon_index] + self.lon_edges[lon_index + 1]) / 2,
+            "count": self.count[lat_index, lon_index],
+            "mse": self.mse[lat_index, lon_index],
+            "rmse": self.rmse[lat_index, lon_index],
+            "mae": self.mae[lat_index, lon_index],
+        })
+
+
+def error_grids(X, y_true, y_pred, cell_sizes=(0.25,), bounds=GERMANY_BOUNDS, lat_column="lat", lon_column="long"):
+    """Returns an ErrorGrid per cell size (in degrees) of the predictions at the coordinates of X.
+
+    The errors are computed once, every cell size only bins the coordinates
+    and reduces the errors with np.bincount. X is not modified. Points
+    outside of the grid or without coordinates are left out.
+    """
+    lat = np.asarray(X[lat_column], dtype="float64")
+    lon = np.asarray(X[lon_column], dtype="float64")
+    errors = np.asarray(y_true, dtype="float64") - np.asarray(y_pred, dtype="float64")
+    finite = np.isfinite(errors)
+    errors = np.where(finite, errors, 0.0)
+    squared_errors = errors ** 2
+    absolute_errors = np.abs(errors)
+
+    grids = {}
+    for cell_size in cell_sizes:
+        lat_edges, lon_edges = create_grid(bounds, cell_size)
+        n_lat, n_lon = len(lat_edges) - 1, len(lon_edges) - 1
+        lat_index = bin_index(lat, lat_edges, cell_size)
+        lon_index = bin_index(lon, lon_edges, cell_size)
+        # The points that are not in a cell are counted in an extra cell at the end, which is dropped
+        cells = np.where(finite & (lat_index >= 0) & (lon_index >= 0), lat_index * n_lon + lon_index, n_lat * n_lon)
+
+        def reduce(weights=None):
+            return np.bincount(cells, weights, minlength=n_lat * n_lon + 1)[:-1].reshape(n_lat, n_lon)
+
+        grids[cell_size] = ErrorGrid(lat_edges, lon_edges, reduce(), reduce(squared_errors), reduce(absolute_errors))
+    return grids
+
+
+def error_grid(X, y_true, y_pred, cell_size=0.25, bounds=GERMANY_BOUNDS, lat_column="lat", lon_column="long"):
+    return error_grids(X, y_true, y_pred, (cell_size,), bounds, lat_column, lon_column)[cell_size]
@@ -0,0 +1,56 @@
+"""Train/test splits and K-fold cross validation by journey (ID_Base).
+
+The functions return integer row positions, so they can index a feature
+matrix that is built once (see feature_matrix) instead of copying the
+DataFrame for every split. All rows of an ID_Base are always on the same
+side of a split.
+"""
+import numpy as np
+import pandas as pd
+
+
+def group_codes(groups):
+    """Integer code of every row, numbered in the order of the first appearance like groups.unique()."""
+    codes, uniques = pd.factorize(groups, use_na_sentinel=False)
+    return codes, len(uniques)
+
+
+def shuffled_groups(n_groups, seed=42):
+    # Same order as np.random.seed(seed); np.random.permutation(groups.unique()), without the global state
+    return np.random.RandomState(seed).permutation(n_groups)
+
+
+def train_test_indices(groups, train_size=0.8, seed=42):
+    """Returns the row positions of the train and test set, the same split as custom_train_test_split."""
+    codes, n_groups = group_codes(groups)
+    order = shuffled_groups(n_groups, seed)
+    in_train = np.zeros(n_groups, dtype=bool)
+    in_train[order[:int(train_size * n_groups)]] = True
+    train = in_train[codes]
+    return np.flatnonzero(train), np.flatnonzero(~train)
+
+
+def group_kfold_indices(groups, n_splits=5, seed=42):
+    """Yields the (train, test) row positions of every fold, like KFold(n_splits, shuffle=True) over the groups.
+
+    Can be passed as cv to the cross validation functions of scikit-learn.
+    """
+    codes, n_groups = group_codes(groups)
+    if n_splits > n_groups:
+        raise ValueError(f"Cannot split {n_groups} groups into {n_splits} folds")
+    fold_of_group = np.empty(n_groups, dtype=np.int64)
+    # The first n_groups % n_splits folds get one group more, like KFold
+    for fold, fold_groups in enumerate(np.array_split(shuffled_groups(n_groups, seed), n_splits)):
+        fold_of_group[fold_groups] = fold
+    fold_of_row = fold_of_group[codes]
+    for fold in range(n_splits):
+        test = fold_of_row == fold
+        yield np.flatnonzero(~test), np.flatnonzero(test)
+
+
+def feature_matrix(df, columns, dtype="float32"):
+    """Copies the columns into one C-contiguous matrix, column by column without a float64 intermediate."""
+    matrix = np.empty((len(df), len(columns)), dtype=dtype)
+    for position, column in enumerate(columns):
+        matrix[:, position] = df[column].to_numpy()
+    return matrix
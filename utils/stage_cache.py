@@ -0,0 +1,106 @@
+import ast
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _project_file(module_name):
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    origin = os.path.abspath(spec.origin)
+    return origin if origin.startswith(PROJECT_ROOT + os.sep) and "site-packages" not in origin else None
+
+
+def source_files(path):
+    """The source file and every module of the project it imports, directly or through other modules of the project.
+
+    Stages keep most of their logic in helper modules, so the key of a stage
+    has to change when any of them changes, not only the file of the stage.
+    """
+    files, pending = set(), [os.path.abspath(path)]
+    while pending:
+        path = pending.pop()
+        if path in files:
+            continue
+        files.add(path)
+        with open(path) as file:
+            tree = ast.parse(file.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # `from package import module` imports a module, `from module import name` an attribute
+                names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for name in names:
+                imported = _project_file(name)
+                if imported is not None:
+                    pending.append(imported)
+    return sorted(files)
+
+
+class StageCache:
+    """Columnar cache for the output of the preprocessing stages.
+
+    Every stage output is stored as a Parquet file keyed by a hash of the
+    stage name, the key of its input and its configuration (including the
+    fingerprints of the files the stage reads). Because the key of a stage
+    is derived from the key of the previous one, a changed input or stage
+    invalidates everything downstream of it.
+    """
+
+    def __init__(self, cache_dir=".stage_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint_file(path, block_size=1 << 20):
+        if not os.path.exists(path):
+            return "missing"
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def stage_key(self, stage_name, input_key, files=(), config=None):
+        payload = {
+            "stage": stage_name,
+            "input": input_key,
+            "files": {path: self.fingerprint_file(path) for path in files},
+            "config": config or {},
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def path(self, stage_name, key):
+        return os.path.join(self.cache_dir, f"{stage_name}-{key}.parquet")
+
+    def has(self, stage_name, key):
+        return os.path.exists(self.path(stage_name, key))
+
+    def load(self, stage_name, key):
+        return pd.read_parquet(self.path(stage_name, key))
+
+    def store(self, stage_name, key, df):
+        target = self.path(stage_name, key)
+        # Write to a temporary file first so a crash never leaves a truncated entry behind
+        tmp_target = target + ".tmp"
+        df.to_parquet(tmp_target)
+        os.replace(tmp_target, target)
+
+        # Only the current output of a stage is kept
+        for stale in glob.glob(self.path(stage_name, "*")):
+            if stale != target:
+                os.remove(stale)
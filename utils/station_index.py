@@ -0,0 +1,180 @@
+import math
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+class StationCoordinateIndex:
+    """IBNR -> (lat, long) lookup for the German stations of train_stations_europe.csv.
+
+    The index is built once into a (3, n) float64 array of IBNRs sorted in
+    ascending order and their coordinates. It is saved next to the source and
+    memory-mapped on load, and rebuilt whenever the source file is newer.
+    """
+
+    def __init__(self, source_path="train_stations_europe.csv", index_path="train_stations_europe_index.npy"):
+        self.source_path = source_path
+        self.index_path = index_path
+        self._index = None
+
+    def build(self):
+        stations = pd.read_csv(self.source_path, usecols=["uic", "latitude", "longitude", "country"])
+        stations = stations[stations["country"] == "DE"].dropna(subset=["uic"])
+        stations = stations.drop_duplicates(subset=["uic"], keep="first").sort_values("uic")
+        index = np.vstack([
+            stations["uic"].to_numpy(dtype="float64"),
+            stations["latitude"].to_numpy(dtype="float64"),
+            stations["longitude"].to_numpy(dtype="float64"),
+        ])
+        np.save(self.index_path, index)
+
+    @property
+    def index(self):
+        if self._index is None:
+            if (
+                not os.path.exists(self.index_path)
+                or os.path.getmtime(self.index_path) < os.path.getmtime(self.source_path)
+            ):
+                self.build()
+            self._index = np.load(self.index_path, mmap_mode="r")
+        return self._index
+
+    def lookup(self, ibnr):
+        """Returns the lat and long arrays for the given IBNRs, NaN where the IBNR is unknown."""
+        ibnr = pd.Series(ibnr).to_numpy(dtype="float64", na_value=np.nan)
+        keys, lats, longs = self.index
+        if len(keys) == 0:
+            return np.full(len(ibnr), np.nan), np.full(len(ibnr), np.nan)
+        positions = np.minimum(np.searchsorted(keys, ibnr), len(keys) - 1)
+        # NaN never compares equal, so missing IBNRs are not found
+        found = keys[positions] == ibnr
+        return np.where(found, lats[positions], np.nan), np.where(found, longs[positions], np.nan)
+
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+ABBREVIATIONS = {"hbf": "hauptbahnhof", "bf": "bahnhof", "bhf": "bahnhof", "str": "strasse"}
+
+
+def normalize_station_name(name):
+    """Lower-cased, transliterated station name with expanded abbreviations and without punctuation."""
+    name = unicodedata.normalize("NFKD", str(name).lower().translate(UMLAUTS))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    tokens = re.sub(r"[^0-9a-z]+", " ", name).split()
+    return " ".join(ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+def name_ngrams(normalized_name, n=3):
+    padded = f" {normalized_name} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+class StationNameIndex:
+    """Offline resolution of station names to coordinates.
+
+    Built from the manually updated coordinates (which take precedence) and
+    the names of the German stations of train_stations_europe.csv, like the
+    IBNR index, so a name is never matched to a foreign station of the same
+    name. Names are matched exactly after normalization first and otherwise
+    by the Dice similarity of their character n-grams, looked up in an
+    inverted index. The similarity is reported as confidence, matches below
+    `min_confidence` count as unresolved.
+    """
+
+    def __init__(
+        self,
+        manual_path="station_coordinates_final_manually_updated.csv",
+        stations_path="train_stations_europe.csv",
+        min_confidence=0.7,
+        n=3,
+    ):
+        self.manual_path = manual_path
+        self.stations_path = stations_path
+        self.min_confidence = min_confidence
+        self.n = n
+        self._built = False
+
+    def build(self):
+        manual = pd.read_csv(self.manual_path, usecols=["clear_station_name", "lat", "long"])
+        stations = pd.read_csv(self.stations_path, usecols=["name", "latitude", "longitude", "country"])
+        stations = stations.loc[stations["country"] == "DE", ["name", "latitude", "longitude"]]
+        stations = stations.rename(columns={"name": "clear_station_name", "latitude": "lat", "longitude": "long"})
+        entries = pd.concat([manual, stations]).dropna()
+        entries["normalized"] = entries["clear_station_name"].map(normalize_station_name)
+        entries = entries.drop_duplicates(subset=["normalized"], keep="first").reset_index(drop=True)
+
+        self.names = entries["clear_station_name"].to_numpy()
+        self.coordinates = entries[["lat", "long"]].to_numpy(dtype="float64")
+        self.exact = dict(zip(entries["normalized"], entries.index))
+
+        gram_ids, entry_grams = {}, []
+        n_grams = np.empty(len(entries), dtype=np.int32)
+        for entry, normalized in enumerate(entries["normalized"]):
+            grams = name_ngrams(normalized, self.n)
+            n_grams[entry] = len(grams)
+            entry_grams.extend(gram_ids.setdefault(gram, len(gram_ids)) for gram in grams)
+        entry_grams = np.array(entry_grams, dtype=np.int32)
+        entry_of_gram = np.repeat(np.arange(len(entries), dtype=np.int32), n_grams)
+        # Inverted index: the entries of every n-gram in ascending order
+        order = np.argsort(entry_grams, kind="stable")
+        self.postings = np.split(entry_of_gram[order], np.cumsum(np.bincount(entry_grams, minlength=len(gram_ids)))[:-1])
+        self.gram_ids = gram_ids
+        self.entry_grams = entry_grams
+        self.entry_starts = np.cumsum(n_grams) - n_grams
+        self.n_grams = n_grams
+        self._built = True
+
+    def search(self, name, min_confidence=None):
+        """Returns the best matching entry and its confidence, (None, 0.0) if no entry can reach min_confidence.
+
+        A Dice similarity of at least t needs t * len(grams) / (2 - t) shared
+        n-grams, so every entry that can reach min_confidence is in the postings
+        of the rarest n-grams of the name. Only these candidates are scored, by
+        looking up their own n-grams, so a lookup does not scan the whole index.
+        Below min_confidence the match is the best of the candidates.
+        """
+        if not self._built:
+            self.build()
+        normalized = normalize_station_name(name)
+        if normalized in self.exact:
+            return self.exact[normalized], 1.0
+
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+        grams = name_ngrams(normalized, self.n)
+        known = [self.gram_ids[gram] for gram in grams if gram in self.gram_ids]
+        known.sort(key=lambda gram: len(self.postings[gram]))
+        min_shared = math.ceil(min_confidence * len(grams) / (2.0 - min_confidence) - 1e-9)
+        n_probes = len(known) - max(min_shared, 1) + 1
+        if n_probes <= 0:
+            return None, 0.0
+        candidates = np.unique(np.concatenate([self.postings[gram] for gram in known[:n_probes]]))
+
+        # Positions of the n-grams of every candidate in entry_grams
+        lengths = self.n_grams[candidates]
+        starts = np.cumsum(lengths) - lengths
+        positions = np.arange(starts[-1] + lengths[-1]) + np.repeat(self.entry_starts[candidates] - starts, lengths)
+        in_name = np.zeros(len(self.gram_ids), dtype=bool)
+        in_name[known] = True
+        shared = np.add.reduceat(in_name[self.entry_grams[positions]], starts, dtype=np.int32)
+        scores = 2.0 * shared / (len(grams) + lengths)
+        # Ties keep the first entry
+        best = int(np.argmax(scores))
+        return int(candidates[best]), float(scores[best])
+
+    def resolve(self, names):
+        """Resolves unique names to a frame indexed by name with matched_name, lat, long and confidence.
+
+        lat and long are NaN for unresolved names.
+        """
+        rows = []
+        for name in dict.fromkeys(names):
+            entry, confidence = self.search(name)
+            if entry is not None and confidence >= self.min_confidence:
+                rows.append((name, self.names[entry], *self.coordinates[entry], confidence))
+            else:
+                rows.append((name, None, np.nan, np.nan, confidence))
+        return pd.DataFrame(
+            rows, columns=["name", "matched_name", "lat", "long", "confidence"]
+        ).set_index("name")
@@ -0,0 +1,103 @@
+import json
+import math
+import os
+
+import pandas as pd
+
+from utils.schema import read_trainrides
+
+
+def partition_by_journey(input_path, spill_dir, n_partitions, chunksize=500_000):
+    """Splits the raw input into partition files by hashing ID_Base.
+
+    All rows of a train (and therefore of every journey) end up in the same
+    partition, so each partition can go through the journey based stages on
+    its own. Values are kept as text until the partition is read again.
+    """
+    paths = [os.path.join(spill_dir, f"partition-{index}.csv") for index in range(n_partitions)]
+    written = set()
+    for chunk in pd.read_csv(input_path, chunksize=chunksize, dtype=str, keep_default_na=False):
+        id_base = chunk["ID"].str.rsplit("-", n=2).str[0]
+        partitions = pd.util.hash_pandas_object(id_base, index=False).to_numpy() % n_partitions
+        for index, part in chunk.groupby(partitions):
+            part.to_csv(paths[index], mode="a", header=index not in written, index=False)
+            written.add(index)
+    return [paths[index] for index in sorted(written)]
+
+
+def iter_journey_chunks(input_path, spill_dir, partition_bytes=256 * 2**20):
+    """Yields the input as dataframes in which no journey is split across chunks."""
+    n_partitions = max(1, math.ceil(os.path.getsize(input_path) / partition_bytes))
+    for path in partition_by_journey(input_path, spill_dir, n_partitions):
+        chunk = read_trainrides(path)
+        os.remove(path)
+        yield chunk
+
+
+class GlobalStats:
+    """Running state of the statistics that are computed over the whole dataset.
+
+    Chunks only contribute partial aggregates (sum/count per city, min/max of
+    the planned arrival), which are reduced here and applied in a second pass.
+    """
+
+    def __init__(self):
+        self.city_delay_sums = pd.Series(dtype="float")
+        self.city_delay_counts = pd.Series(dtype="float")
+        self.arrival_min = pd.NaT
+        self.arrival_max = pd.NaT
+
+    def update_city_delays(self, df):
+        partial = df.groupby("city")["arrival_delay_m"].agg(["sum", "count"])
+        self.city_delay_sums = self.city_delay_sums.add(partial["sum"], fill_value=0)
+        self.city_delay_counts = self.city_delay_counts.add(partial["count"], fill_value=0)
+
+    def update_date_bounds(self, df):
+        arrival_min = df["arrival_plan"].min()
+        arrival_max = df["arrival_plan"].max()
+        if pd.isna(self.arrival_min) or arrival_min < self.arrival_min:
+            self.arrival_min = arrival_min
+        if pd.isna(self.arrival_max) or arrival_max > self.arrival_max:
+            self.arrival_max = arrival_max
+
+    @property
+    def date_bounds(self):
+        return self.arrival_min, self.arrival_max
+
+    def to_dict(self):
+        return {
+            "city_delay_sums": self.city_delay_sums.to_dict(),
+            "city_delay_counts": self.city_delay_counts.to_dict(),
+            "arrival_min": None if pd.isna(self.arrival_min) else self.arrival_min.isoformat(),
+            "arrival_max": None if pd.isna(self.arrival_max) else self.arrival_max.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls()
+        stats.city_delay_sums = pd.Series(state["city_delay_sums"], dtype="float")
+        stats.city_delay_counts = pd.Series(state["city_delay_counts"], dtype="float")
+        stats.arrival_min = pd.Timestamp(state["arrival_min"]) if state["arrival_min"] else pd.NaT
+        stats.arrival_max = pd.Timestamp(state["arrival_max"]) if state["arrival_max"] else pd.NaT
+        return stats
+
+    @property
+    def city_avg_delay(self):
+        # Cities without any known delay get NaN, like in groupby(...).transform("mean")
+        return self.city_delay_sums / self.city_delay_counts.replace({0: float("nan")})
+
+
+def load_state(path):
+    """Returns the persisted GlobalStats and the committed batches of an incremental output."""
+    if not os.path.exists(path):
+        return GlobalStats(), []
+    with open(path) as file:
+        state = json.load(file)
+    return GlobalStats.from_dict(state["stats"]), state["batches"]
+
+
+def save_state(path, stats, batches):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"stats": stats.to_dict(), "batches": batches}, file)
+    os.replace(tmp_path, path)
@@ -0,0 +1,246 @@
+"""Successive halving hyperparameter search by journey over a feature matrix in shared memory.
+
+The feature matrix, the target and the journey of every row are written once
+as .npy files to shared memory and opened as memory maps by the workers of a
+process pool, so the candidates are not pickled with the data. Every rung fits
+the remaining candidates on a subsample of the journeys of every fold and
+keeps the best 1/factor of them; the last rung uses all training journeys.
+Every result is appended to a JSON lines file, a search that is started again
+with the same file skips the fits that are already in it.
+
+    python -m utils.tuning --input DBtrainrides_complete_preprocessed_2.csv --model tree --results tuning/tree.jsonl
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.linear_model import Lasso, LinearRegression
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid
+from sklearn.tree import DecisionTreeRegressor
+
+from utils.sharding import _shared_dir
+from utils.splits import feature_matrix, group_codes, shuffled_groups, train_test_indices
+
+# The grids of the training notebooks, LinearRegression has no hyperparameters worth searching
+MODELS = {
+    "tree": (DecisionTreeRegressor(random_state=42), {
+        "max_depth": [3, 5, 10, None],
+        "min_samples_split": [2, 5, 10],
+        "max_leaf_nodes": [10, 20, 15],
+    }),
+    "lasso": (Lasso(), {"alpha": list(np.logspace(-4, 0, 10))}),
+    "linear": (LinearRegression(), {"fit_intercept": [True, False]}),
+}
+# Columns of the output of main.py that are not features, like in custom_train_test_split
+NON_FEATURE_COLUMNS = ["arrival_delay_m", "transformed_info_message", "arrival_plan", "departure_plan"]
+
+# Memory maps of the shared arrays, opened once per worker process
+_arrays = {}
+
+
+def _load(path):
+    if path not in _arrays:
+        _arrays[path] = np.load(path, mmap_mode="r")
+    return _arrays[path]
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True, default=lambda value: value.item())
+
+
+def _fit_candidate(estimator, params, data_dir, scoring, fold, n_groups):
+    """Fits one candidate on the first n_groups subsample journeys of the training folds and scores it on the fold."""
+    X, y = _load(os.path.join(data_dir, "X.npy")), _load(os.path.join(data_dir, "y.npy"))
+    fold_of_row = _load(os.path.join(data_dir, "fold.npy"))
+    rank_of_row = _load(os.path.join(data_dir, "rank.npy"))
+    train = np.flatnonzero((fold_of_row != fold) & (rank_of_row < n_groups))
+    test = np.flatnonzero(fold_of_row == fold)
+
+    start = time.perf_counter()
+    model = clone(estimator).set_params(**params).fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+    return get_scorer(scoring)(model, X[test], y[test]), fit_seconds
+
+
+class SuccessiveHalvingSearch:
+    """Successive halving over the candidates of param_grid with journey grouped K-fold cross validation.
+
+    After fit, best_params_ and best_score_ are those of the best candidate of
+    the last rung and results_ holds every fit. Scores follow the scikit-learn
+    convention that higher is better, e.g. the negative MAE.
+    """
+
+    def __init__(self, estimator, param_grid, results_path=None, n_splits=3, factor=3, min_groups=100,
+                 scoring="neg_mean_absolute_error", n_workers=None, seed=42):
+        self.estimator = estimator
+        self.candidates = list(ParameterGrid(param_grid))
+        self.results_path = results_path
+        self.n_splits = n_splits
+        self.factor = factor
+        self.min_groups = min_groups
+        self.scoring = scoring
+        self.n_workers = n_workers or os.cpu_count()
+        self.seed = seed
+
+    def rungs(self):
+        """Number of rungs until at most factor candidates are left for the last rung."""
+        n_rungs, n_candidates = 1, len(self.candidates)
+        while n_candidates > self.factor:
+            n_candidates = math.ceil(n_candidates / self.factor)
+            n_rungs += 1
+        return n_rungs
+
+    def config(self, X, y, n_groups):
+        return {
+            "estimator": repr(self.estimator),
+            "candidates": [params_key(params) for params in self.candidates],
+            "rows": X.shape[0],
+            "features": X.shape[1],
+            "groups": n_groups,
+            "target_sum": float(np.sum(y, dtype="float64")),
+            "n_splits": self.n_splits,
+            "factor": self.factor,
+            "min_groups": self.min_groups,
+            "scoring": self.scoring,
+            "seed": self.seed,
+        }
+
+    def load_results(self, config):
+        """Returns the results of an earlier run of the same search, keyed by (rung, params, fold)."""
+        if self.results_path is None or not os.path.exists(self.results_path):
+            return {}
+        with open(self.results_path) as file:
+            content = file.read()
+        if content and not content.endswith("\n"):
+            # The last line of an interrupted search can be incomplete, the next result starts on a new line
+            with open(self.results_path, "a") as file:
+                file.write("\n")
+        lines = []
+        for line in content.splitlines():
+            try:
+                lines.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        if lines and lines[0] != {"config": config}:
+            raise ValueError(f"{self.results_path} belongs to a different search, use another results file")
+        return {(result["rung"], result["params"], result["fold"]): result for result in lines[1:]}
+
+    def append_result(self, result):
+        if self.results_path is None:
+            return
+        with open(self.results_path, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+    def fit(self, X, y, groups):
+        X = np.asarray(X, dtype="float32")
+        y = np.asarray(y, dtype="float64")
+        codes, n_groups = group_codes(groups)
+        if n_groups < self.n_splits:
+            raise ValueError(f"Cannot split {n_groups} groups into {self.n_splits} folds")
+        config = self.config(X, y, n_groups)
+        done = self.load_results(config)
+        if self.results_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.results_path)), exist_ok=True)
+            if not os.path.exists(self.results_path) or os.path.getsize(self.results_path) == 0:
+                self.append_result({"config": config})
+
+        # Folds as in group_kfold_indices, the subsamples are the journeys with the lowest rank of a second shuffle
+        fold_of_group = np.empty(n_groups, dtype=np.int8)
+        for fold, fold_groups in enumerate(np.array_split(shuffled_groups(n_groups, self.seed), self.n_splits)):
+            fold_of_group[fold_groups] = fold
+        rank_of_group = np.empty(n_groups, dtype=np.int64)
+        rank_of_group[shuffled_groups(n_groups, self.seed + 1)] = np.arange(n_groups)
+
+        data_dir = tempfile.mkdtemp(prefix="tuning-", dir=_shared_dir())
+        try:
+            np.save(os.path.join(data_dir, "X.npy"), X)
+            np.save(os.path.join(data_dir, "y.npy"), y)
+            np.save(os.path.join(data_dir, "fold.npy"), fold_of_group[codes])
+            np.save(os.path.join(data_dir, "rank.npy"), rank_of_group[codes])
+            with ProcessPoolExecutor(self.n_workers) as pool:
+                results = self.run_rungs(pool, data_dir, n_groups, done)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+        self.results_ = pd.DataFrame(results)
+        last_rung = self.results_[self.results_["rung"] == self.results_["rung"].max()]
+        scores = last_rung.groupby("params", sort=False)["score"].mean()
+        self.best_params_ = json.loads(scores.idxmax())
+        self.best_score_ = scores.max()
+        return self
+
+    def run_rungs(self, pool, data_dir, n_groups, done):
+        candidates = [params_key(params) for params in self.candidates]
+        n_rungs = self.rungs()
+        results = []
+        for rung in range(n_rungs):
+            # The last rung uses all journeys, every rung before it factor times fewer
+            rung_groups = max(self.min_groups, math.ceil(n_groups / self.factor ** (n_rungs - 1 - rung)))
+            rung_groups = min(rung_groups, n_groups)
+            futures = {}
+            for key in candidates:
+                for fold in range(self.n_splits):
+                    if (rung, key, fold) in done:
+                        results.append(done[(rung, key, fold)])
+                        continue
+                    future = pool.submit(
+                        _fit_candidate, self.estimator, json.loads(key), data_dir, self.scoring, fold, rung_groups
+                    )
+                    futures[future] = (key, fold)
+            for future in as_completed(futures):
+                key, fold = futures[future]
+                score, fit_seconds = future.result()
+                result = {
+                    "rung": rung, "params": key, "fold": fold, "groups": rung_groups,
+                    "score": float(score), "fit_seconds": fit_seconds,
+                }
+                self.append_result(result)
+                results.append(result)
+
+            rung_results = pd.DataFrame([result for result in results if result["rung"] == rung])
+            scores = rung_results.groupby("params")["score"].mean().reindex(candidates)
+            print(f"Rung {rung}: {len(candidates)} candidates on {rung_groups} journeys, best {scores.max():.4f}")
+            if rung < n_rungs - 1:
+                # Ties keep the earlier candidate of the grid
+                n_keep = math.ceil(len(candidates) / self.factor)
+                candidates = list(scores.sort_values(ascending=False, kind="stable").index[:n_keep])
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive halving search for the delay models on the output of main.py")
+    parser.add_argument("--input", default="DBtrainrides_complete_preprocessed_2.csv")
+    parser.add_argument("--model", choices=list(MODELS), default="tree")
+    parser.add_argument("--results", help="JSON lines file of the fits, an interrupted search with the same file resumes")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--folds", type=int, default=3)
+    parser.add_argument("--factor", type=int, default=3)
+    parser.add_argument("--scoring", default="neg_mean_absolute_error")
+    args = parser.parse_args()
+
+    df = pd.read_parquet(args.input) if args.input.endswith(".parquet") else pd.read_csv(args.input)
+    features = [column for column in df.columns if column not in NON_FEATURE_COLUMNS]
+    X = feature_matrix(df, features)
+    y = df["arrival_delay_m"].to_numpy(dtype="float64")
+    # The test journeys of custom_train_test_split are left out of the search
+    train, test = train_test_indices(df["ID_Base"], 0.8)
+
+    estimator, param_grid = MODELS[args.model]
+    search = SuccessiveHalvingSearch(
+        estimator, param_grid, args.results, n_splits=args.folds, factor=args.factor,
+        scoring=args.scoring, n_workers=args.workers,
+    )
+    search.fit(X[train], y[train], df["ID_Base"].iloc[train])
+    model = clone(estimator).set_params(**search.best_params_).fit(X[train], y[train])
+    print(f"Best parameters: {search.best_params_}")
+    print(f"Cross validation {args.scoring}: {search.best_score_:.4f}")
+    print(f"Test {args.scoring}: {get_scorer(args.scoring)(model, X[test], y[test]):.4f}")
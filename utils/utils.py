@@ -1,38 +1,12 @@
 import pandas as pd
 import numpy as np
 
-def df_converter(df):
-    # Convert specified columns to desired types
-    df = df.astype(
-        {
-            "ID_Base": "string",
-            "ID_Timestamp": "string",
-            "stop_number": "int",
-            "line": "string",
-            "starting_station_IBNR": "string",
-            "zip": "string",
-            "last_station": "string",
-            "IBNR": "string",
-            "long": "float",
-            "lat": "float",
-            "arrival_delay_m": "float",
-            "departure_delay_m": "float",
-            "info": "string",
-            "canceled": "bool",
-        }
-    )
-
-    # Convert columns with timestamp format
-    timestamp_columns = [
-        "arrival_plan",
-        "departure_plan",
-        "arrival_change",
-        "departure_change",
-    ]
-    for column in timestamp_columns:
-        df[column] = pd.to_datetime(df[column])
+from utils.schema import STOP_DTYPES, apply_schema
+from utils.splits import train_test_indices
 
-    return df
+def df_converter(df):
+    # Convert the columns to the declared schema, columns that already have their dtype are kept as they are
+    return apply_schema(df, STOP_DTYPES)
 
 def clean_up_df(df, columns):
     return df.drop(columns=columns)
@@ -42,6 +16,28 @@ def filter_canceled(df):
     df = df.drop(columns=["canceled"])
     return df
 
+def parse_id_timestamps(timestamps):
+    # Decodes YYMMDDHHMM timestamps, every distinct value is parsed once and mapped back by its code
+    codes, uniques = pd.factorize(timestamps)
+    # Integer coded timestamps are decoded from their digits as well
+    uniques = pd.Series(np.asarray(uniques, dtype=object)).astype(str)
+    valid = uniques.str.fullmatch(r"\d{10}").fillna(False).to_numpy(dtype=bool)
+    digits = uniques[valid].str
+    parts = pd.DataFrame({
+        "year": 2000 + digits[0:2].astype(int),  # Assuming years are 2020+
+        "month": digits[2:4].astype(int),
+        "day": digits[4:6].astype(int),
+        "hour": digits[6:8].astype(int),
+        "minute": digits[8:10].astype(int),
+    })
+    # to_datetime would carry an hour of 24 or more into the next day instead of rejecting it
+    parsed = pd.to_datetime(parts, errors="coerce").where((parts["hour"] < 24) & (parts["minute"] < 60))
+
+    # The last slot stays NaT for the missing values, which have the code -1
+    values = np.full(len(uniques) + 1, np.datetime64("NaT"), dtype="datetime64[ns]")
+    values[:-1][valid] = parsed.to_numpy(dtype="datetime64[ns]")
+    return pd.Series(values[codes], index=timestamps.index, name=timestamps.name)
+
 def fill_missing_times(group):
     # Iterate through the rows in the group and find rows with NaT values
     for i in range(len(group)):
@@ -60,28 +56,47 @@ def fill_missing_times(group):
     return group
 
 def ordinal_scaling(df, column, new_target_column, ordering):
-    df[column] = pd.Categorical(
-        df['transformed_info_message'],
-        categories=ordering,
-        ordered=True
-    )
+    if isinstance(df[column].dtype, pd.CategoricalDtype):
+        # Only the categories are remapped, the values are not encoded again
+        df[column] = df[column].cat.set_categories(ordering, ordered=True)
+    else:
+        df[column] = pd.Categorical(
+            df[column],
+            categories=ordering,
+            ordered=True
+        )
     
     df[new_target_column] = df[column].cat.codes
     return df
 
-def normalize_dates(df):
+def fill_missing_journey_times(df):
+    # A stop without any planned time gets the planned arrival of the next stop of its journey minus 5 minutes,
+    # if that stop has one. Like fill_missing_times, the next stop is not filled before it is read.
+    journeys = df.groupby(["ID_Base", "ID_Timestamp"], sort=False)
+    next_arrival = journeys["arrival_plan"].shift(-1)
+    fill = df["arrival_plan"].isna() & df["departure_plan"].isna() & next_arrival.notna()
+
+    df = df.copy()
+    filled = next_arrival[fill] - pd.Timedelta(minutes=5)
+    df.loc[fill, "arrival_plan"] = filled
+    df.loc[fill, "departure_plan"] = filled
+    # groupby(...).apply leaves out the rows without a journey key
+    return df[df["ID_Base"].notna() & df["ID_Timestamp"].notna()]
+
+def fill_missing_journey_times_groupby(df):
+    return df.groupby(["ID_Base", "ID_Timestamp"], group_keys=False).apply(fill_missing_times)
+
+def fill_missing_dates(df, executor=None):
     df['arrival_plan'] = pd.to_datetime(df['arrival_plan'], errors='coerce')
     df['departure_plan'] = pd.to_datetime(df['departure_plan'], errors='coerce')
 
     df = df.sort_values(by=["ID_Base", "ID_Timestamp", "stop_number"])
-    df = df.groupby(["ID_Base", "ID_Timestamp"], group_keys=False).apply(fill_missing_times)
-
-    # Find the min and max for arrival and departure
-    arrival_min = df['arrival_plan'].min()
-    arrival_max = df['arrival_plan'].max()
-    departure_min = df['departure_plan'].min()
-    departure_max = df['departure_plan'].max()
+    if executor is None:
+        return fill_missing_journey_times(df)
+    # The journeys are independent of each other, so they can be filled in parallel shards
+    return executor.map(fill_missing_journey_times, df)
 
+def apply_date_normalization(df, arrival_min, arrival_max):
     # Normalize arrival and departure times to [0, 1]
     df['arrival_normalized'] = (df['arrival_plan'] - arrival_min) / (arrival_max - arrival_min)
     df['departure_normalized'] = (df['departure_plan'] - arrival_min) / (arrival_max - arrival_min)
@@ -94,18 +109,20 @@ def normalize_dates(df):
     df["IBNR"] = df["IBNR"].fillna(0.0)
     return df
 
+def normalize_dates(df, executor=None):
+    df = fill_missing_dates(df, executor)
+
+    # Find the min and max for arrival
+    arrival_min = df['arrival_plan'].min()
+    arrival_max = df['arrival_plan'].max()
+    return apply_date_normalization(df, arrival_min, arrival_max)
+
 def custom_train_test_split(df, target_column, train_size):
-    target = df["arrival_delay_m"]
-    unique_base_ids = df['ID_Base'].unique()
-    np.random.seed(42)
-    shuffled_ids = np.random.permutation(unique_base_ids)
-    split_index = int(train_size * len(shuffled_ids))
-    base_ids_80 = shuffled_ids[:split_index]  # 80% of Base_IDs
-    base_ids_20 = shuffled_ids[split_index:]  # 20% of Base_IDs
-    X_train = df[df['ID_Base'].isin(base_ids_80)]
-    X_test = df[df['ID_Base'].isin(base_ids_20)]
-    y_train = X_train[target_column]
-    y_test = X_test[target_column] 
-    X_train = X_train.drop(columns=["arrival_delay_m", "transformed_info_message","arrival_plan","departure_plan"])
-    X_test = X_test.drop(columns=["arrival_delay_m", "transformed_info_message","arrival_plan","departure_plan"])
+    # ID_Base is factorized once, see utils/splits.py for the row positions without the DataFrame copies
+    train_rows, test_rows = train_test_indices(df["ID_Base"], train_size)
+    features = df.columns.drop(["arrival_delay_m", "transformed_info_message", "arrival_plan", "departure_plan"], errors="ignore")
+    X_train = df.iloc[train_rows][features]
+    X_test = df.iloc[test_rows][features]
+    y_train = df[target_column].iloc[train_rows]
+    y_test = df[target_column].iloc[test_rows]
     return X_train, y_train, X_test, y_test
\ No newline at end of file